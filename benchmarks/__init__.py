@@ -0,0 +1,41 @@
+"""Micro benchmarks for the hot paths
+
+Each module can be run directly, e.g. ``python -m benchmarks.bench_xor``
+"""
+import timeit
+
+
+KiB = 2 ** 10
+MiB = 2 ** 20
+
+SIZES = (16, 4 * KiB, 64 * MiB)
+
+
+def format_size(n):
+    for unit, scale in (('MiB', MiB), ('KiB', KiB)):
+        if n >= scale:
+            return '{:g} {}'.format(n / scale, unit)
+    return '{} B'.format(n)
+
+
+def best_time(func, *args, repeat=3):
+    "Best time, in seconds, of a single call of func(*args)"
+    timer = timeit.Timer(lambda: func(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def compare(funcs, args_by_size):
+    """Print a table timing each of `funcs` against each input size
+
+    `args_by_size` maps an input size in bytes to the arguments to call with.
+    """
+    names = [func.__name__ for func in funcs]
+    print('{:>10}'.format('size'), *('{:>22}'.format(name) for name in names))
+    for size, args in args_by_size.items():
+        timings = [best_time(func, *args) for func in funcs]
+        cells = (
+            '{:>9.3g}s {:>7.1f} MiB/s'.format(secs, size / secs / MiB)
+            for secs in timings
+        )
+        print('{:>10}'.format(format_size(size)), *cells)
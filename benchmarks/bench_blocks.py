@@ -0,0 +1,68 @@
+"""utils.iter_blocks against utils.grouper: time and memory allocated"""
+
+import os
+import tracemalloc
+
+from cryptopals.utils import grouper, iter_blocks
+
+from . import KiB, MiB, best_time, format_size
+
+
+SIZE = 1 * MiB
+BLOCK_SIZES = (16, 256, 4 * KiB)
+
+
+def stream_grouper(data, block_size):
+    for _ in grouper(block_size, data):
+        pass
+
+
+def stream_iter_blocks(data, block_size):
+    for _ in iter_blocks(data, block_size):
+        pass
+
+
+def list_grouper(data, block_size):
+    return list(grouper(block_size, data))
+
+
+def list_iter_blocks(data, block_size):
+    return list(iter_blocks(data, block_size))
+
+
+def peak_allocated(func, *args):
+    "Peak bytes allocated by tracemalloc's count during func(*args)"
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    data = os.urandom(SIZE)
+    print(
+        '{} of blocks, each iterated over, or collected in a list'.format(
+            format_size(SIZE)
+        )
+    )
+    print('{:>10} {:>20} {:>12} {:>14}'.format('block', '', 'time', 'peak alloc'))
+    for block_size in BLOCK_SIZES:
+        for func in (
+            stream_grouper,
+            stream_iter_blocks,
+            list_grouper,
+            list_iter_blocks,
+        ):
+            secs = best_time(func, data, block_size)
+            peak = peak_allocated(func, data, block_size)
+            print(
+                '{:>10} {:>20} {:>11.3g}s {:>14}'.format(
+                    format_size(block_size), func.__name__, secs, format_size(peak)
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Throughput of each aes.CBC_ENGINES mode"""
+import os
+
+from cryptopals.aes import decrypt_cbc, encrypt_cbc
+
+from . import KiB, MiB, compare
+
+
+# the reference engine manages well under 1 MiB/s, so spare it 64 MiB
+SIZES = (16, 4 * KiB, 1 * MiB)
+# around aes.PARALLEL_MIN_SIZE, where worker processes start to pay off
+PARALLEL_SIZES = (256 * KiB, 1 * MiB, 4 * MiB)
+WORKERS = max(os.cpu_count() or 1, 2)
+PASSWORD = b'YELLOW SUBMARINE'
+
+
+def encrypt_cbc_native(plaintext):
+    return encrypt_cbc(plaintext, PASSWORD, engine='native')
+
+
+def encrypt_cbc_reference(plaintext):
+    return encrypt_cbc(plaintext, PASSWORD, engine='reference')
+
+
+def decrypt_cbc_native(ciphertext):
+    return decrypt_cbc(ciphertext, PASSWORD, engine='native')
+
+
+def decrypt_cbc_reference(ciphertext):
+    return decrypt_cbc(ciphertext, PASSWORD, engine='reference')
+
+
+def decrypt_cbc_reference_workers(ciphertext):
+    return decrypt_cbc(ciphertext, PASSWORD, engine='reference', workers=WORKERS)
+
+
+def main():
+    args_by_size = {size: (os.urandom(size),) for size in SIZES}
+    compare([encrypt_cbc_native, encrypt_cbc_reference], args_by_size)
+    print()
+    compare([decrypt_cbc_native, decrypt_cbc_reference], args_by_size)
+    print()
+    print('{} workers'.format(WORKERS))
+    args_by_size = {size: (os.urandom(size),) for size in PARALLEL_SIZES}
+    compare([decrypt_cbc_reference, decrypt_cbc_reference_workers], args_by_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""chal12's byte-at-a-time attack, with and without batched oracle queries"""
+from cryptopals.set2.chal12 import ecb_decrypt, encryption_oracle
+
+from . import best_time
+
+
+def per_call_oracle(plaintext):
+    "Hides encryption_oracle.many, so the attack makes one call per query"
+    return encryption_oracle(plaintext)
+
+
+def main():
+    for oracle in (per_call_oracle, encryption_oracle):
+        secs = best_time(ecb_decrypt, oracle)
+        print('{:>20} {:>9.3g}s'.format(oracle.__name__, secs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""utils.xor against the hex round trip it replaced"""
+import os
+from base64 import b16encode
+
+from cryptopals.utils import decode_hex, xor
+
+from . import SIZES, compare
+
+
+def xor_via_hex(bs1, bs2):
+    "The old implementation of utils.xor"
+    h1 = b16encode(bs1)
+    h2 = b16encode(bs2)
+    result_int = int(h1, base=16) ^ int(h2, base=16)
+    return decode_hex('{:0{}x}'.format(result_int, len(h1)))
+
+
+def xor_into_buffer(data, out):
+    return xor(data, data, out=out)
+
+
+def xor_single_byte_key(data, out):
+    return xor(data, b'K', out=out)
+
+
+def main():
+    print('equal length buffers')
+    compare(
+        [xor_via_hex, xor],
+        {size: (os.urandom(size), os.urandom(size)) for size in SIZES},
+    )
+    print('\nvariants of the new engine')
+    compare(
+        [xor_into_buffer, xor_single_byte_key],
+        {size: (os.urandom(size), bytearray(size)) for size in SIZES},
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""The benchmark suite: the hot paths at several input sizes
+
+Run it, storing the timings as a JSON baseline::
+
+    python -m benchmarks.suite run --output benchmarks/baseline.json
+
+then after a change, fail if anything got slower than the baseline by
+more than a percentage::
+
+    python -m benchmarks.suite compare benchmarks/baseline.json --threshold 10
+
+Or ``make bench-baseline`` and ``make bench-compare``.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from base64 import b16encode, b64decode
+from collections import namedtuple
+from textwrap import dedent
+
+import numpy as np
+
+from cryptopals.aes import decrypt_cbc, encrypt_cbc, encrypt_ecb
+from cryptopals.set1.chal3 import ngram_scoring_functions, scoring_functions
+from cryptopals.set1.chal5 import repeating_key_xor, repeating_key_xor_bytes
+from cryptopals.set1.chal6 import (
+    decrypt_repeating_key_xor,
+    hamming_distance,
+    solve_columns,
+)
+from cryptopals.set1.chal8 import detect_ecb, get_uniq_block_counts
+from cryptopals.set2.chal12 import UNKNOWN_STRING, ecb_decrypt
+from cryptopals.utils import (
+    CSPRNG,
+    grouper,
+    iter_blocks,
+    pad,
+    random_bytes,
+    xor,
+    xor_hex,
+)
+
+from . import KiB, MiB, best_time, format_size
+
+
+# slower than the baseline by more than this percentage is a regression
+THRESHOLD = 10.0
+PASSWORD = b'YELLOW SUBMARINE'
+ENGLISH = dedent(
+    """\
+    Now that you have the keysize, break the ciphertext into blocks of
+    keysize length. Solve each block as if it was single-character XOR.
+    You already have code to do this. For each block, the single-byte XOR
+    key that produces the best looking histogram is the repeating-key XOR
+    key byte for that block. Put them together and you have the key.
+    """
+).encode()
+
+Benchmark = namedtuple('Benchmark', 'name func setup sizes')
+
+BENCHMARKS = []
+
+
+def benchmark(func, sizes, name=None):
+    """Register the decorated `setup(size)`, returning the arguments to time
+    `func` with at each of `sizes`
+    """
+
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name or func.__name__, func, setup, sizes))
+        return setup
+
+    return register
+
+
+def seeded_bytes(size):
+    "The same pseudo random bytes every run, so timings are comparable"
+    return random_bytes(size, rng=random.Random(size))
+
+
+def english(size):
+    return (ENGLISH * (size // len(ENGLISH) + 1))[:size]
+
+
+@benchmark(xor, sizes=(16, 4 * KiB, 1 * MiB))
+def xor_args(size):
+    return seeded_bytes(size), seeded_bytes(size)[::-1]
+
+
+@benchmark(xor_hex, sizes=(16, 4 * KiB, 64 * KiB))
+def xor_hex_args(size):
+    return b16encode(seeded_bytes(size)), b16encode(seeded_bytes(size)[::-1])
+
+
+@benchmark(encrypt_cbc, sizes=(16, 4 * KiB, 1 * MiB))
+def encrypt_cbc_args(size):
+    return seeded_bytes(size), PASSWORD
+
+
+@benchmark(decrypt_cbc, sizes=(16, 4 * KiB, 1 * MiB))
+def decrypt_cbc_args(size):
+    return encrypt_cbc(seeded_bytes(size), PASSWORD), PASSWORD
+
+
+def decrypt_cbc_pkcs7(ciphertext, password):
+    return decrypt_cbc(ciphertext, password, padding='pkcs7')
+
+
+@benchmark(decrypt_cbc_pkcs7, sizes=(16, 4 * KiB, 1 * MiB))
+def decrypt_cbc_pkcs7_args(size):
+    return encrypt_cbc(seeded_bytes(size), PASSWORD, padding='pkcs7'), PASSWORD
+
+
+def grouper_blocks(n, data):
+    return list(grouper(n, data))
+
+
+@benchmark(grouper_blocks, sizes=(16, 4 * KiB, 64 * KiB))
+def grouper_args(size):
+    return 16, seeded_bytes(size)
+
+
+def iter_blocks_list(data, block_size):
+    return list(iter_blocks(data, block_size))
+
+
+@benchmark(iter_blocks_list, sizes=(16, 4 * KiB, 64 * KiB))
+def iter_blocks_args(size):
+    return seeded_bytes(size), 16
+
+
+@benchmark(random_bytes, sizes=(16, 4 * KiB, 1 * MiB))
+def random_bytes_args(size):
+    return (size,)
+
+
+def random_bytes_below_200(size):
+    return random_bytes(size, upto=200)
+
+
+@benchmark(random_bytes_below_200, sizes=(16, 4 * KiB, 1 * MiB))
+def random_bytes_below_200_args(size):
+    return (size,)
+
+
+def random_bytes_csprng(size):
+    return random_bytes(size, rng=CSPRNG)
+
+
+@benchmark(random_bytes_csprng, sizes=(16, 4 * KiB, 1 * MiB))
+def random_bytes_csprng_args(size):
+    return (size,)
+
+
+def english_args(size):
+    return (english(size),)
+
+
+for score_func in scoring_functions + ngram_scoring_functions:
+    benchmark(score_func, sizes=(16, 256, 4 * KiB))(english_args)
+
+
+@benchmark(hamming_distance, sizes=(16, 4 * KiB, 64 * KiB))
+def hamming_distance_args(size):
+    return seeded_bytes(size), seeded_bytes(size)[::-1]
+
+
+@benchmark(repeating_key_xor, sizes=(16, 4 * KiB, 64 * KiB))
+def repeating_key_xor_args(size):
+    return english(size), b'ICE'
+
+
+@benchmark(repeating_key_xor_bytes, sizes=(4 * KiB, 1 * MiB, 16 * MiB))
+def repeating_key_xor_bytes_args(size):
+    return seeded_bytes(size), b'Terminator X: Bring the noise'
+
+
+@benchmark(decrypt_repeating_key_xor, sizes=(1 * KiB, 4 * KiB))
+def decrypt_repeating_key_xor_args(size):
+    return (xor(english(size), b'Terminator X: Bring the noise'),)
+
+
+@benchmark(solve_columns, sizes=(64 * KiB, 1 * MiB, 4 * MiB))
+def solve_columns_args(size):
+    "A long key, as the columns get long"
+    return xor(english(size), seeded_bytes(128)), 128
+
+
+def detect_ecb_lines(lines):
+    return detect_ecb(get_uniq_block_counts(lines))
+
+
+@benchmark(detect_ecb_lines, sizes=(4 * KiB, 64 * KiB, 1 * MiB))
+def detect_ecb_args(size):
+    "Lines of 160 bytes of hex, one of them ECB encrypted"
+    n_lines = size // 320
+    lines = [b16encode(seeded_bytes(160 + line)[-160:]) for line in range(n_lines)]
+    lines[n_lines // 2] = b16encode(encrypt_ecb(b'A' * 160, PASSWORD))
+    return (lines,)
+
+
+@benchmark(ecb_decrypt, sizes=(16, 64, 138))
+def ecb_decrypt_args(size):
+    "An oracle appending the first `size` bytes of the chal12 secret"
+    secret = b64decode(UNKNOWN_STRING)[:size]
+
+    def encryption_oracle(plaintext):
+        return encrypt_ecb(pad(plaintext + secret, 16), PASSWORD)
+
+    return (encryption_oracle,)
+
+
+def run(name_filter='', repeat=3):
+    """Time every benchmark, returning {'meta': {...}, 'results': {key: secs}}
+
+    Results are keyed by benchmark name and input size, e.g. 'xor/4096'.
+    """
+    results = {}
+    for bench in BENCHMARKS:
+        if name_filter not in bench.name:
+            continue
+        for size in bench.sizes:
+            secs = best_time(bench.func, *bench.setup(size), repeat=repeat)
+            key = '{}/{}'.format(bench.name, size)
+            results[key] = secs
+            print(
+                '{:>40} {:>10} {:>12.4g}s'.format(bench.name, format_size(size), secs)
+            )
+    meta = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    return {'meta': meta, 'results': results}
+
+
+def regressions(baseline, current, threshold=THRESHOLD):
+    """return {key: percent slower} for results slower than `baseline`'s by
+    more than `threshold` percent
+
+    >>> regressions({'xor/16': 1.0, 'xor/64': 2.0}, {'xor/16': 1.2, 'xor/64': 1.0})
+    {'xor/16': 20.0}
+    >>> regressions({'xor/16': 1.0}, {'xor/16': 1.2}, threshold=25)
+    {}
+    """
+    changes = {
+        key: round((current[key] - secs) / secs * 100, 1)
+        for key, secs in baseline.items()
+        if key in current
+    }
+    return {key: change for key, change in changes.items() if change > threshold}
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    "Print each result against the baseline, return the regressions"
+    baseline, current = baseline['results'], current['results']
+    for key in sorted(baseline.keys() | current.keys()):
+        if key not in current or key not in baseline:
+            print('{:>50} {}'.format(key, 'only in one run'))
+            continue
+        change = (current[key] - baseline[key]) / baseline[key] * 100
+        print(
+            '{:>50} {:>12.4g}s {:>12.4g}s {:>+8.1f}%'.format(
+                key, baseline[key], current[key], change
+            )
+        )
+    return regressions(baseline, current, threshold)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='time the benchmarks')
+    run_parser.add_argument('--output', help='JSON file to store the timings in')
+    compare_parser = subparsers.add_parser('compare', help='compare to a baseline')
+    compare_parser.add_argument('baseline', help='JSON file from a previous run')
+    compare_parser.add_argument(
+        'current', nargs='?', help='JSON file to compare, instead of running now'
+    )
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    for subparser in (run_parser, compare_parser):
+        subparser.add_argument('--filter', default='', help='only names containing')
+        subparser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        timings = run(args.filter, args.repeat)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(timings, f, indent=2, sort_keys=True)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        current = run(args.filter, args.repeat)
+    slower = compare(baseline, current, args.threshold)
+    if slower:
+        print('\n{} regressed by more than {:g}%:'.format(len(slower), args.threshold))
+        for key, change in slower.items():
+            print('{:>50} {:>+8.1f}%'.format(key, change))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,102 @@
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 # Python Cryptography Toolkit (pycrypto)
 from Crypto.Cipher import AES
 
-from .utils import grouper, xor
+from .tracing import traced
+from .utils import Padder, Unpadder, iter_blocks, pad_tail, unpad, xor
 
 
 PAD_CHAR = b'\x04'
 IV = b'\x00' * AES.block_size
+# how much of a file to hold in memory at once when streaming
+CHUNK_SIZE = 2 ** 16
+# below this many bytes, starting worker processes costs more than it saves
+PARALLEL_MIN_SIZE = 2 ** 20
+# engines worth decrypting in worker processes: 'native' is a single C call
+# running at memory speed, which worker processes only slow down
+PARALLEL_ENGINES = ('reference',)
+# CTR keystream is generated this many blocks at a time
+CTR_BATCH_BLOCKS = 2 ** 14
+# default CTR layout: 8 byte nonce followed by a 64 bit little endian counter
+CTR_NONCE = b'\x00' * 8
+# how many expanded keys each thread keeps
+CIPHER_CACHE_SIZE = 64
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+
+class CipherCache:
+    """LRU cache of AES cipher objects, keyed by password and mode
+
+    Creating a cipher object runs the key schedule, which we'd rather not
+    repeat for every block an attack encrypts under the same key. Only
+    cache modes without per-message state, such as ECB.
+
+    A cipher object isn't guaranteed to be safe to share between threads,
+    so each thread caches its own, up to `maxsize` of them. The hit and
+    miss counts are totals across all threads.
+    """
+
+    def __init__(self, maxsize=CIPHER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # bumped to have every thread drop its ciphers
+        self._generation = 0
+
+    def _ciphers(self):
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            local.generation = self._generation
+            local.ciphers = OrderedDict()
+        return local.ciphers
+
+    def get(self, password, mode=AES.MODE_ECB):
+        ciphers = self._ciphers()
+        # any bytes-like password, hashable
+        password = bytes(password)
+        key = (password, mode)
+        cipher = ciphers.get(key)
+        hit = cipher is not None
+        if hit:
+            ciphers.move_to_end(key)
+        else:
+            cipher = ciphers[key] = AES.new(password, mode)
+            while len(ciphers) > self.maxsize:
+                ciphers.popitem(last=False)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return cipher
+
+    def info(self):
+        "Like functools.lru_cache's cache_info, currsize is for this thread"
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._ciphers()))
+
+    def clear(self):
+        with self._lock:
+            self.hits = self.misses = 0
+            self._generation += 1
+
+
+cipher_cache = CipherCache()
 
 
 def encrypt_ecb(plaintext, password):
-    crypter = AES.new(password, AES.MODE_ECB)
+    crypter = cipher_cache.get(password, AES.MODE_ECB)
     return crypter.encrypt(plaintext)
 
 
 def decrypt_ecb(ciphertext, password):
-    crypter = AES.new(password, AES.MODE_ECB)
+    crypter = cipher_cache.get(password, AES.MODE_ECB)
     return crypter.decrypt(ciphertext)
 
 
@@ -28,23 +110,406 @@ def _decrypt_cbc(ciphertext, password):
     return crypter.decrypt(ciphertext).rstrip(PAD_CHAR)
 
 
-def encrypt_cbc(plaintext, password, iv=IV, block_size=AES.block_size):
+def _pad_partial_block(data, block_size):
+    "Pad out any final partial block with PAD_CHAR, as iter_blocks does"
+    if not len(data) % block_size:
+        return data
+    return data + PAD_CHAR * (-len(data) % block_size)
+
+
+def _encrypt_cbc_native(plaintext, password, iv, block_size):
+    crypter = AES.new(password, AES.MODE_CBC, iv)
+    return crypter.encrypt(_pad_partial_block(plaintext, block_size))
+
+
+def _decrypt_cbc_native(ciphertext, password, iv, block_size, out=None):
+    ciphertext = _pad_partial_block(ciphertext, block_size)
+    # into a bytearray, for unpad to trim in place
+    plaintext = bytearray(len(ciphertext)) if out is None else out
+    AES.new(password, AES.MODE_CBC, iv).decrypt(ciphertext, output=plaintext)
+    return plaintext
+
+
+def _encrypt_cbc_reference(plaintext, password, iv, block_size):
     # padded_plaintext = pad(plaintext, block_size)
     res = []
     crypt_block = iv
-    for plain_block in grouper(block_size, plaintext):
+    for plain_block in iter_blocks(plaintext, block_size):
         block = xor(plain_block, crypt_block)
         crypt_block = encrypt_ecb(block, password)
         res.append(crypt_block)
     return b''.join(res)
 
 
-def decrypt_cbc(ciphertext, password, iv=IV, block_size=AES.block_size):
-    res = []
+def _decrypt_cbc_reference(ciphertext, password, iv, block_size, out=None):
+    if out is None:
+        out = bytearray(-(-len(ciphertext) // block_size) * block_size)
     prev_block = iv
-    for cipher_block in grouper(block_size, ciphertext):
+    for start, cipher_block in zip(
+        range(0, len(out), block_size), iter_blocks(ciphertext, block_size)
+    ):
         block = decrypt_ecb(cipher_block, password)
-        plain_block = xor(block, prev_block)
-        res.append(plain_block)
+        out[start : start + block_size] = xor(block, prev_block)
         prev_block = cipher_block
-    return b''.join(res).rstrip(PAD_CHAR)
+    return out
+
+
+# 'native' hands the whole message to the cipher library in one call,
+# 'reference' is our own block by block implementation of the mode. The
+# decrypters can write the plaintext into a given buffer, `out`
+CBC_ENGINES = {
+    'native': (_encrypt_cbc_native, _decrypt_cbc_native),
+    'reference': (_encrypt_cbc_reference, _decrypt_cbc_reference),
+}
+
+
+def _decrypt_cbc_blocks(ciphertext, password, iv, block_size, engine, out=None):
+    _, decrypter = CBC_ENGINES[engine]
+    return decrypter(ciphertext, password, iv, block_size, out)
+
+
+@traced('aes.encrypt_cbc')
+def encrypt_cbc(
+    plaintext, password, iv=IV, block_size=AES.block_size, engine='native', padding=None
+):
+    """CBC encrypt, applying `padding`: 'pkcs7' or 'legacy', see utils.PADDINGS
+
+    Without `padding`, only a final partial block is padded, with PAD_CHAR.
+    """
+    encrypter, _ = CBC_ENGINES[engine]
+    if padding is None:
+        return encrypter(plaintext, password, iv, block_size)
+    # encrypt the whole blocks in place, then the padded tail chained on
+    n, tail = pad_tail(plaintext, block_size, padding)
+    head = encrypter(memoryview(plaintext)[:n], password, iv, block_size) if n else b''
+    return head + encrypter(tail, password, head[-block_size:] or iv, block_size)
+
+
+def _decrypt_cbc_shard(
+    in_name, out_name, start, stop, password, iv, block_size, engine
+):
+    from multiprocessing.shared_memory import SharedMemory
+
+    in_memory = SharedMemory(name=in_name)
+    out_memory = SharedMemory(name=out_name)
+    try:
+        if start:
+            # the block before the shard chains into its first block
+            iv = bytes(in_memory.buf[start - block_size : start])
+        # straight from one shared buffer into the other
+        with in_memory.buf[start:stop] as ciphertext:
+            with out_memory.buf[start:stop] as plaintext:
+                _decrypt_cbc_blocks(
+                    ciphertext, password, iv, block_size, engine, plaintext
+                )
+    finally:
+        in_memory.close()
+        out_memory.close()
+
+
+def _decrypt_cbc_parallel(ciphertext, password, iv, block_size, engine, workers):
+    """Decrypt shards of the ciphertext in separate processes
+
+    Each plaintext block only depends on its ciphertext block and the one
+    before, so the workers are independent. They decrypt straight from the
+    ciphertext in shared memory into the plaintext in shared memory, rather
+    than having shards pickled back and forth, leaving just the copies in
+    and out. Shared memory is new in Python 3.8, before which this decrypts
+    serially.
+    """
+    try:
+        from multiprocessing.shared_memory import SharedMemory
+    except ImportError:
+        return _decrypt_cbc_blocks(ciphertext, password, iv, block_size, engine)
+    ciphertext = _pad_partial_block(ciphertext, block_size)
+    n = len(ciphertext)
+    n_blocks = n // block_size
+    shard_size = -(-n_blocks // workers) * block_size
+    in_memory = SharedMemory(create=True, size=n)
+    out_memory = SharedMemory(create=True, size=n)
+    try:
+        in_memory.buf[:n] = ciphertext
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _decrypt_cbc_shard,
+                    in_memory.name,
+                    out_memory.name,
+                    start,
+                    min(start + shard_size, n),
+                    password,
+                    iv,
+                    block_size,
+                    engine,
+                )
+                for start in range(0, n, shard_size)
+            ]
+            for future in futures:
+                future.result()
+        return bytearray(out_memory.buf[:n])
+    finally:
+        for memory in (in_memory, out_memory):
+            memory.close()
+            memory.unlink()
+
+
+@traced('aes.decrypt_cbc')
+def decrypt_cbc(
+    ciphertext,
+    password,
+    iv=IV,
+    block_size=AES.block_size,
+    engine='native',
+    workers=None,
+    padding='legacy',
+):
+    """CBC decrypt and strip `padding`, returning a bytearray
+
+    'legacy' strips any trailing PAD_CHAR, even those that were part of the
+    plaintext. 'pkcs7' strips exactly the padding, raising ValueError if
+    it's invalid, and None strips nothing. Pass `workers` to decrypt large
+    ciphertexts in that many processes, with PARALLEL_ENGINES.
+    """
+    parallel = workers and workers > 1 and engine in PARALLEL_ENGINES
+    if parallel and len(ciphertext) >= PARALLEL_MIN_SIZE:
+        plaintext = _decrypt_cbc_parallel(
+            ciphertext, password, iv, block_size, engine, workers
+        )
+    else:
+        plaintext = _decrypt_cbc_blocks(ciphertext, password, iv, block_size, engine)
+    if padding is None:
+        return plaintext
+    return unpad(plaintext, block_size, padding)
+
+
+class CBCEncryptor:
+    """Incremental version of `encrypt_cbc`
+
+    Feed the plaintext in chunks of any size to `update`, then call
+    `finalize`. Joined together, the returned ciphertext is the same as
+    `encrypt_cbc` of the whole plaintext.
+    """
+
+    def __init__(
+        self, password, iv=IV, block_size=AES.block_size, engine='native', padding=None
+    ):
+        self.password = password
+        self.block_size = block_size
+        self.engine = engine
+        # the last ciphertext block, to chain into the next plaintext block
+        self._prev_block = iv
+        self._partial = b''
+        self._padder = padding and Padder(block_size, padding)
+
+    def update(self, plaintext):
+        if self._padder:
+            plaintext = self._padder.update(plaintext)
+        data = self._partial + plaintext if self._partial else plaintext
+        n = len(data) - len(data) % self.block_size
+        self._partial = bytes(data[n:])
+        if not n:
+            return b''
+        ciphertext = encrypt_cbc(
+            data[:n], self.password, self._prev_block, self.block_size, self.engine
+        )
+        self._prev_block = ciphertext[-self.block_size :]
+        return ciphertext
+
+    def finalize(self):
+        # encrypt_cbc pads out any partial block
+        plaintext = self._partial
+        if self._padder:
+            plaintext += self._padder.finalize()
+        ciphertext = encrypt_cbc(
+            plaintext, self.password, self._prev_block, self.block_size, self.engine
+        )
+        self._partial = b''
+        return ciphertext
+
+
+class CBCDecryptor:
+    """Incremental version of `decrypt_cbc`
+
+    The plaintext goes through an Unpadder, which holds back what may be
+    `padding` until `finalize` can strip it just as `decrypt_cbc` does.
+    """
+
+    def __init__(
+        self,
+        password,
+        iv=IV,
+        block_size=AES.block_size,
+        engine='native',
+        padding='legacy',
+    ):
+        self.password = password
+        self.block_size = block_size
+        self.engine = engine
+        self._prev_block = iv
+        self._partial = b''
+        self._unpadder = padding and Unpadder(block_size, padding)
+
+    def _decrypt(self, ciphertext):
+        plaintext = _decrypt_cbc_blocks(
+            ciphertext, self.password, self._prev_block, self.block_size, self.engine
+        )
+        self._prev_block = ciphertext[-self.block_size :]
+        return plaintext
+
+    def update(self, ciphertext):
+        data = self._partial + ciphertext
+        n = len(data) - len(data) % self.block_size
+        self._partial = data[n:]
+        if not n:
+            return b''
+        plaintext = self._decrypt(data[:n])
+        if self._unpadder:
+            return self._unpadder.update(plaintext)
+        return plaintext
+
+    def finalize(self):
+        # like decrypt_cbc, decrypt a partial final block padded out
+        plaintext = b''
+        if self._partial:
+            plaintext = self._decrypt(self._partial)
+        self._partial = b''
+        if self._unpadder:
+            tail = self._unpadder.update(plaintext)
+            return b''.join((tail, self._unpadder.finalize()))
+        return plaintext
+
+
+def _crypt_file(crypter, in_file, out_file, chunk_size):
+    for chunk in iter(lambda: in_file.read(chunk_size), b''):
+        out_file.write(crypter.update(chunk))
+    out_file.write(crypter.finalize())
+
+
+def encrypt_cbc_file(
+    in_file,
+    out_file,
+    password,
+    iv=IV,
+    block_size=AES.block_size,
+    chunk_size=CHUNK_SIZE,
+    padding=None,
+):
+    "Encrypt binary file object `in_file` into `out_file`, a chunk at a time"
+    encryptor = CBCEncryptor(password, iv, block_size, padding=padding)
+    _crypt_file(encryptor, in_file, out_file, chunk_size)
+
+
+def decrypt_cbc_file(
+    in_file,
+    out_file,
+    password,
+    iv=IV,
+    block_size=AES.block_size,
+    chunk_size=CHUNK_SIZE,
+    padding='legacy',
+):
+    "Decrypt binary file object `in_file` into `out_file`, a chunk at a time"
+    decryptor = CBCDecryptor(password, iv, block_size, padding=padding)
+    _crypt_file(decryptor, in_file, out_file, chunk_size)
+
+
+def ctr_counter_blocks(
+    nonce, first, n_blocks, byteorder='little', block_size=AES.block_size
+):
+    """The counter blocks for block numbers `first` to `first + n_blocks`
+
+    Each is `nonce` followed by the block number, as an integer of the
+    remaining block_size - len(nonce) bytes, which may be at most 8. The
+    block number wraps around at the top of that range.
+    """
+    counter_size = block_size - len(nonce)
+    assert 0 < counter_size <= 8
+    dtype = np.dtype('uint64').newbyteorder('<' if byteorder == 'little' else '>')
+    counters = np.arange(first, first + n_blocks, dtype=np.uint64).astype(dtype)
+    counter_bytes = counters.view(np.uint8).reshape(n_blocks, 8)
+    if byteorder == 'little':
+        counter_bytes = counter_bytes[:, :counter_size]
+    else:
+        counter_bytes = counter_bytes[:, 8 - counter_size :]
+    blocks = np.empty((n_blocks, block_size), dtype=np.uint8)
+    blocks[:, : len(nonce)] = np.frombuffer(nonce, dtype=np.uint8)
+    blocks[:, len(nonce) :] = counter_bytes
+    return blocks.tobytes()
+
+
+class CTRCipher:
+    """AES in CTR mode, built on `encrypt_ecb`
+
+    As the keystream for any block can be computed directly from its block
+    number, you can `seek` to any offset and decrypt from there, without
+    having to process what comes before. Keystream is generated in batches
+    of `CTR_BATCH_BLOCKS` blocks, spread across `workers` threads.
+    """
+
+    def __init__(
+        self,
+        password,
+        nonce=CTR_NONCE,
+        byteorder='little',
+        initial_value=0,
+        block_size=AES.block_size,
+        workers=None,
+    ):
+        self.password = password
+        self.nonce = nonce
+        self.byteorder = byteorder
+        self.initial_value = initial_value
+        self.block_size = block_size
+        self.workers = workers
+        self.position = 0
+
+    def seek(self, offset):
+        self.position = offset
+
+    def tell(self):
+        return self.position
+
+    def _keystream_blocks(self, first, n_blocks):
+        counter_blocks = ctr_counter_blocks(
+            self.nonce,
+            self.initial_value + first,
+            n_blocks,
+            self.byteorder,
+            self.block_size,
+        )
+        return encrypt_ecb(counter_blocks, self.password)
+
+    def keystream(self, offset, length):
+        "The `length` bytes of keystream starting at byte `offset`"
+        first = offset // self.block_size
+        stop = -(-(offset + length) // self.block_size)
+        batches = [
+            (start, min(CTR_BATCH_BLOCKS, stop - start))
+            for start in range(first, stop, CTR_BATCH_BLOCKS)
+        ]
+        if self.workers and self.workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                keystream = b''.join(
+                    executor.map(lambda batch: self._keystream_blocks(*batch), batches)
+                )
+        else:
+            keystream = b''.join(self._keystream_blocks(*batch) for batch in batches)
+        skip = offset - first * self.block_size
+        return keystream[skip : skip + length]
+
+    @traced('aes.ctr_crypt')
+    def crypt(self, data):
+        "Encrypt or decrypt `data` from the current position onwards"
+        keystream = self.keystream(self.position, len(data))
+        self.position += len(data)
+        return xor(data, keystream)
+
+    encrypt = decrypt = crypt
+
+
+def encrypt_ctr(plaintext, password, nonce=CTR_NONCE, **kwargs):
+    return CTRCipher(password, nonce, **kwargs).encrypt(plaintext)
+
+
+def decrypt_ctr(ciphertext, password, nonce=CTR_NONCE, **kwargs):
+    return CTRCipher(password, nonce, **kwargs).decrypt(ciphertext)
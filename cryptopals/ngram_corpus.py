@@ -0,0 +1,57 @@
+"""Regenerate the bigram and trigram CSVs from the Python documentation
+
+The corpus is the prose lines of the standard library's pydoc_data.topics,
+counted with chal3's `count_ngrams`. The counts depend on the Python
+version's documentation; the committed tables were made with Python 3.11.
+Run `python -m cryptopals.ngram_corpus`, then `make tables`.
+"""
+import csv
+import sys
+
+from .set1.chal3 import count_ngrams
+from .tables import DATA_DIR, csv_path
+
+
+# lines mostly of letters and spaces, to leave out code and tables
+MIN_PROSE_PROPORTION = 0.9
+
+
+def prose_lines(text):
+    "The lines of `text` that read as prose, stripped"
+    for line in text.splitlines():
+        stripped = line.strip()
+        # indented blocks and interactive sessions are examples
+        if not stripped or line.startswith(' ' * 6):
+            continue
+        if stripped.startswith(('>>>', '...')):
+            continue
+        prose = sum(ch.isalpha() or ch == ' ' for ch in stripped)
+        if prose / len(stripped) >= MIN_PROSE_PROPORTION:
+            yield stripped
+
+
+def corpus_text():
+    "The prose of the Python documentation, as ASCII bytes"
+    from pydoc_data.topics import topics
+
+    lines = (line for topic in topics.values() for line in prose_lines(topic))
+    return ' '.join(lines).encode('ascii', 'ignore')
+
+
+def write_ngram_csv(counts, n, data_dir=DATA_DIR):
+    "Write {n-gram: count} `counts`, most common first, as ngrams{n}'s CSV"
+    with open(csv_path('ngrams{}'.format(n), data_dir), 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['{}-gram'.format(n), '*/*'])
+        writer.writerows(counts.most_common())
+
+
+def write_ngram_csvs(ns=(2, 3), data_dir=DATA_DIR, text=None):
+    "Count the n-grams of `text`, by default `corpus_text`, and write CSVs"
+    text = corpus_text() if text is None else text
+    for n in ns:
+        write_ngram_csv(count_ngrams(text, n), n, data_dir)
+
+
+if __name__ == '__main__':
+    write_ngram_csvs(data_dir=sys.argv[1] if len(sys.argv) > 1 else DATA_DIR)
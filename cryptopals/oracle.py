@@ -1,7 +1,19 @@
+import hashlib
 import random
+import time
+from collections import Counter, OrderedDict, namedtuple
 
-from .aes import encrypt_cbc, encrypt_ecb
-from .utils import grouper, pad, random_bytes
+from .aes import CacheInfo, encrypt_cbc, encrypt_ecb
+from .tracing import count, span, traced
+from .utils import iter_blocks, pad, random_bytes
+
+
+# how many responses a CachedOracle keeps
+ORACLE_CACHE_SIZE = 2 ** 12
+# the largest block size profile_oracle looks for
+MAX_BLOCK_SIZE = 64
+
+OracleProfile = namedtuple('OracleProfile', 'block_size is_ecb prefix_len suffix_len')
 
 
 def encryption_oracle(plaintext):
@@ -18,10 +30,229 @@ def encryption_oracle(plaintext):
         return encrypt_cbc(final_plaintext, password, iv)
 
 
-def detect_cipher(encryption_func):
+def encryption_oracle_many(plaintexts):
+    """Batch form of `encryption_oracle`
+
+    Every plaintext gets its own random key, padding and mode, so there's
+    no setup to share: this is here so that all our oracles have a batch form.
+    """
+    return [encryption_oracle(plaintext) for plaintext in plaintexts]
+
+
+encryption_oracle.many = encryption_oracle_many
+
+
+def oracle_many(encryption_func, plaintexts):
+    """Encrypt each of `plaintexts` with `encryption_func`, returning a list
+
+    Oracles with a `many` attribute are handed the whole batch, to share
+    setup between the plaintexts, otherwise we call them once each.
+    """
+    many = getattr(encryption_func, 'many', None)
+    if many is None:
+        return [encryption_func(plaintext) for plaintext in plaintexts]
+    return many(plaintexts)
+
+
+def detect_cipher(encryption_func, profile=None):
     "Return True for ECB, False for CBC"
+    if profile is not None:
+        return profile.is_ecb
     plaintext = random_bytes(16) * 3
     ciphertext = encryption_func(plaintext)
-    blocks = list(grouper(16, ciphertext))
+    blocks = list(iter_blocks(ciphertext, 16))
     num_uniq_blocks = len(set(blocks))
     return num_uniq_blocks < len(blocks)
+
+
+class CachedOracle:
+    """LRU cache in front of a deterministic oracle
+
+    Responses are keyed by a digest of the plaintext, so long plaintexts
+    don't stay in memory. `hits` is the number of oracle calls avoided.
+    Only use this with oracles that always encrypt a plaintext the same way.
+    """
+
+    def __init__(self, encryption_func, maxsize=ORACLE_CACHE_SIZE):
+        self.encryption_func = encryption_func
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._responses = OrderedDict()
+
+    @staticmethod
+    def _key(plaintext):
+        return hashlib.blake2b(plaintext, digest_size=16).digest()
+
+    def _store(self, key, ciphertext):
+        self._responses[key] = ciphertext
+        while len(self._responses) > self.maxsize:
+            self._responses.popitem(last=False)
+
+    def __call__(self, plaintext):
+        return self.many([plaintext])[0]
+
+    def many(self, plaintexts):
+        keys = [self._key(plaintext) for plaintext in plaintexts]
+        found = {}
+        to_query = {}
+        for key, plaintext in zip(keys, plaintexts):
+            if key in self._responses:
+                self._responses.move_to_end(key)
+                found[key] = self._responses[key]
+                self.hits += 1
+            elif key in to_query:
+                # repeated within the batch
+                self.hits += 1
+            else:
+                to_query[key] = plaintext
+        self.misses += len(to_query)
+        count('oracle.cache_hits', len(keys) - len(to_query))
+        count('oracle.cache_misses', len(to_query))
+        with span('oracle.query', plaintexts=len(to_query)):
+            ciphertexts = oracle_many(self.encryption_func, list(to_query.values()))
+        for key, ciphertext in zip(to_query, ciphertexts):
+            found[key] = ciphertext
+            self._store(key, ciphertext)
+        return [found[key] for key in keys]
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._responses))
+
+
+class MeteredOracle:
+    """Count the cost of the queries made of an oracle
+
+    Records the number of queries and calls (a batch of plaintexts counts
+    as one call but many queries), bytes sent and received, time spent in
+    the oracle and a histogram of call latencies.
+    """
+
+    def __init__(self, encryption_func):
+        self.encryption_func = encryption_func
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+        # {upper bound in microseconds, a power of 2: number of calls}
+        self.latency_histogram = Counter()
+
+    def __call__(self, plaintext):
+        return self.many([plaintext])[0]
+
+    def many(self, plaintexts):
+        start = time.perf_counter()
+        ciphertexts = oracle_many(self.encryption_func, plaintexts)
+        seconds = time.perf_counter() - start
+        self.queries += len(plaintexts)
+        self.calls += 1
+        self.bytes_sent += sum(map(len, plaintexts))
+        self.bytes_received += sum(map(len, ciphertexts))
+        self.seconds += seconds
+        self.latency_histogram[2 ** int(seconds * 1e6).bit_length()] += 1
+        return ciphertexts
+
+    def report(self, recovered_bytes=None):
+        "Dict of the counts, with queries per byte if given the bytes recovered"
+        report = {
+            'queries': self.queries,
+            'calls': self.calls,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'seconds': self.seconds,
+            'latency_histogram_us': dict(sorted(self.latency_histogram.items())),
+        }
+        if recovered_bytes:
+            report['queries_per_byte'] = self.queries / recovered_bytes
+        return report
+
+
+def run_metered(attack, encryption_func, *args, **kwargs):
+    """Run `attack(encryption_func, *args, **kwargs)` counting oracle usage
+
+    Return the attack's result and the oracle's cost report. Where the
+    result is the recovered text, the report includes queries per byte.
+    """
+    metered_oracle = MeteredOracle(encryption_func)
+    result = attack(metered_oracle, *args, **kwargs)
+    recovered_bytes = len(result) if isinstance(result, (bytes, str)) else None
+    return result, metered_oracle.report(recovered_bytes)
+
+
+def _first_repeated_block(ciphertext, block_size, baseline=b''):
+    """Index of the first block equal to the next one, or None
+
+    Pairs also found at the same place in `baseline`, the ciphertext of no
+    input, are the oracle's own, e.g. repeated prefix blocks, and skipped.
+    """
+    blocks = list(iter_blocks(ciphertext, block_size, tail='keep'))
+    for block_num, (block, next_block) in enumerate(zip(blocks, blocks[1:])):
+        pair = slice(block_num * block_size, (block_num + 2) * block_size)
+        if block == next_block and baseline[pair] != ciphertext[pair]:
+            return block_num
+    return None
+
+
+def _filler_alignment(encryption_func, block_size):
+    """return (fill_len, block_num) for the fewest filler bytes, beyond two
+    blocks' worth, that give two equal adjacent ciphertext blocks of ours
+
+    Each length is tried with filler A ended by B, and filler B ended by A.
+    Only a pair repeated in both, that differs between them, is filler:
+    prefix and suffix blocks, even repeated ones, encrypt the same way in
+    both, and a block holding the terminator or a prefix byte can't repeat
+    in both.
+    """
+
+    def blocks(filler, terminator, fill_len):
+        plaintext = filler * (2 * block_size + fill_len) + terminator
+        return list(iter_blocks(encryption_func(plaintext), block_size, tail='keep'))
+
+    for fill_len in range(block_size):
+        a_blocks = blocks(b'A', b'B', fill_len)
+        b_blocks = blocks(b'B', b'A', fill_len)
+        pairs = zip(a_blocks, a_blocks[1:], b_blocks, b_blocks[1:])
+        for block_num, (a_block, a_next, b_block, b_next) in enumerate(pairs):
+            if a_block == a_next and b_block == b_next and a_block != b_block:
+                return fill_len, block_num
+    raise ValueError('no repeated blocks: is the oracle deterministic?')
+
+
+@traced('oracle.profile')
+def profile_oracle(encryption_func, max_block_size=MAX_BLOCK_SIZE):
+    """Find an oracle's block size, mode, and the lengths of the fixed
+    prefix and secret suffix it adds to our plaintext
+
+    The block size is how far the ciphertext length jumps as our plaintext
+    grows. For ECB, the prefix length comes from how many bytes it takes to
+    align two blocks of our own, and the suffix is what's left. Uses
+    O(block size) queries, fewer than 3 blocks' worth. Keep the returned
+    OracleProfile to pass to attacks, rather than profiling again. Only
+    for oracles that encrypt the same plaintext the same way each time.
+    """
+    baseline = encryption_func(b'')
+    base_len = len(baseline)
+    for input_len in range(1, max_block_size + 1):
+        block_size = len(encryption_func(b'A' * input_len)) - base_len
+        if block_size:
+            break
+    else:
+        raise ValueError('ciphertext length never jumps: not a block cipher?')
+    # a full block of padding is added when prefix + input + suffix aligns
+    extra_len = base_len - input_len
+
+    # any prefix alignment leaves two whole blocks in 3 blocks - 1 of ours
+    plaintext = b'A' * (3 * block_size - 1)
+    ciphertext = encryption_func(plaintext)
+    if _first_repeated_block(ciphertext, block_size, baseline) is None:
+        return OracleProfile(block_size, False, None, None)
+
+    fill_len, block_num = _filler_alignment(encryption_func, block_size)
+    prefix_len = block_num * block_size - fill_len
+    if not 0 <= prefix_len <= extra_len:
+        raise ValueError('inconsistent prefix length: is the oracle deterministic?')
+    return OracleProfile(block_size, True, prefix_len, extra_len - prefix_len)
@@ -17,47 +17,58 @@ You now have our permission to make "ETAOIN SHRDLU" jokes on Twitter.
 """
 
 
-import csv
 import random
 import string
 from base64 import b16encode
+from collections import Counter
+from functools import lru_cache
 
+import numpy as np
+
+from ..tables import load_table
 from ..testing_utils import param_by_functions, reproducible_randomness
-from ..utils import decode_hex, xor_hex
+from ..tracing import traced
+from ..utils import decode_hex, xor, xor_hex
 
 
 # prevent 'imported but unused'
 reproducible_randomness
 
 
+def single_letter_xor_plaintexts_bytes(ciphertext, character_domain=string.printable):
+    """return {message plaintext: letter} dict"""
+    if not ciphertext:
+        return {b'': letter for letter in character_domain}
+    return {xor(ciphertext, letter.encode()): letter for letter in character_domain}
+
+
 def single_letter_xor_plaintexts(input_hex, character_domain=string.printable):
     """return {message plaintext: letter} dict"""
-    n = len(decode_hex(input_hex))
-    return {
-        decode_hex(xor_hex(input_hex, b16encode((n * letter).encode()))): letter
-        for letter in character_domain
-    }
+    return single_letter_xor_plaintexts_bytes(decode_hex(input_hex), character_domain)
+
+
+def find_xor_plaintext_bytes(ciphertext):
+    """return (key byte, plaintext) bytes tuple"""
+    key, plaintext, _ = break_single_byte_xor(ciphertext)
+    return bytes([key]), plaintext
 
 
 def find_xor_plaintext(input_hex):
-    plaintext_letter_map = single_letter_xor_plaintexts(input_hex)
-    best = select_most_englishest(list(plaintext_letter_map.keys()))
-    return plaintext_letter_map[best], best
+    key, plaintext = find_xor_plaintext_bytes(decode_hex(input_hex))
+    return key.decode('latin-1'), plaintext
 
 
+@lru_cache()
 def get_letter_proportion_map():
     """return {letter: expected occurence proportion} dict
 
     Data from http://norvig.com/mayzner.html
     """
-    with open('cryptopals/ngrams1_any_position.csv') as f:
-        rdr = csv.reader(f)
-        next(rdr)  # col heading row
-        occurence_map = {letter: int(count) for letter, count in rdr}
-    total_occurences = sum(occurence_map.values())
+    table = load_table('ngrams1')
+    total_occurences = int(table.counts.sum())
     return {
-        letter: occurences / total_occurences
-        for letter, occurences in occurence_map.items()
+        letter: int(occurences) / total_occurences
+        for letter, occurences in zip(table.alphabet, table.counts)
     }
 
 
@@ -89,7 +100,7 @@ def ord_average_score(text):
     return (letters_av - text_av) ** 2
 
 
-def letter_freq_score(text, english_proportion_map=get_letter_proportion_map()):
+def letter_freq_score(text, english_proportion_map=None):
     """Score based on character frequency
 
     For each letter in `text` + the alphabet, assess how its number
@@ -98,6 +109,8 @@ def letter_freq_score(text, english_proportion_map=get_letter_proportion_map()):
     This approach may be needed when plaintexts are jumbled letter
     phrases (as opposed to random bytes).
     """
+    if english_proportion_map is None:
+        english_proportion_map = get_letter_proportion_map()
     n = len(text)
     text = text.decode().upper().replace(' ', '')
     character_domain = set(string.ascii_uppercase) | set(text)
@@ -119,7 +132,222 @@ def select_most_englishest(texts, score_func=letter_freq_score):
     return min(texts, key=score_func)
 
 
-scoring_functions = (simple_score, letter_freq_score, ord_average_score)
+# share of English text bytes taken by each class of character
+SPACE_SHARE = 0.15
+LETTER_SHARE = 0.78
+UPPERCASE_SHARE = 0.1  # of the letters
+COMMON_SHARE = 0.065
+COMMON_CHARACTERS = string.digits + ".,'\"-;:?!\n"
+# and what's left of 1, over the rest of string.printable
+OTHER_PRINTABLE_SHARE = 0.005
+NON_PRINTABLE_PROPORTION = 1e-6
+
+
+@lru_cache()
+def byte_score_table():
+    """Array of the score for each byte value: its negative log probability
+
+    The unigram letter frequencies are spread over the other bytes we
+    expect to see in English text.
+    """
+    proportions = np.full(256, NON_PRINTABLE_PROPORTION)
+    others = set(string.printable) - set(string.ascii_letters + COMMON_CHARACTERS)
+    for ch in others:
+        proportions[ord(ch)] = OTHER_PRINTABLE_SHARE / len(others)
+    for ch in COMMON_CHARACTERS:
+        proportions[ord(ch)] = COMMON_SHARE / len(COMMON_CHARACTERS)
+    proportions[ord(' ')] = SPACE_SHARE
+    for letter, proportion in get_letter_proportion_map().items():
+        proportions[ord(letter)] = LETTER_SHARE * UPPERCASE_SHARE * proportion
+        proportions[ord(letter.lower())] = (
+            LETTER_SHARE * (1 - UPPERCASE_SHARE) * proportion
+        )
+    return -np.log(proportions)
+
+
+# KEY_XOR_BYTE[key, byte] == key ^ byte
+KEY_XOR_BYTE = np.bitwise_xor.outer(np.arange(256), np.arange(256))
+
+
+@lru_cache()
+def key_score_matrix():
+    "Matrix of the score of each byte value, decrypted with each key"
+    return byte_score_table()[KEY_XOR_BYTE]
+
+
+def byte_histogram(data):
+    return np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+
+
+def byte_freq_score(text):
+    """Average negative log probability of each byte of `text` being English
+
+    The table lookup version of `letter_freq_score`.
+    """
+    if not text:
+        return 0.0
+    return float(byte_score_table() @ byte_histogram(text)) / len(text)
+
+
+@traced('chal3.rank_single_byte_xor_keys')
+def rank_single_byte_xor_keys(ciphertext, top_k=5):
+    """Score all 256 single byte XOR keys against bytes `ciphertext`
+
+    Rather than decrypting with each key, the ciphertext's byte histogram is
+    scored with one matrix multiplication. Returns the `top_k` best
+    (key, score) pairs, best (lowest `byte_freq_score`) first.
+    """
+    n = max(len(ciphertext), 1)
+    scores = key_score_matrix() @ byte_histogram(ciphertext) / n
+    keys = np.argsort(scores, kind='stable')[:top_k]
+    return [(int(key), float(scores[key])) for key in keys]
+
+
+def break_single_byte_xor(ciphertext):
+    """return (key, plaintext, score) for the best single byte XOR key"""
+    [(key, score)] = rank_single_byte_xor_keys(ciphertext, top_k=1)
+    if not ciphertext:
+        return key, b'', score
+    return key, xor(ciphertext, bytes([key])), score
+
+
+# n-grams are counted over letters, case folded, whitespace as ' ', digits and
+# common punctuation as '.' and any other printable character as '#'
+NGRAM_ALPHABET = string.ascii_uppercase + ' .#'
+NGRAM_PUNCTUATION = string.digits + ".,'\"-;:?!()"
+# and bytes outside string.printable are a class of their own
+NGRAM_CLASSES = len(NGRAM_ALPHABET) + 1
+# how many observations the shorter context's prediction is worth, when
+# smoothing the longer context's counts
+NGRAM_SMOOTHING = 10
+
+
+def _byte_class(byte):
+    ch = chr(byte)
+    if ch in string.ascii_letters:
+        return NGRAM_ALPHABET.index(ch.upper())
+    if ch in string.whitespace:
+        return NGRAM_ALPHABET.index(' ')
+    if ch in NGRAM_PUNCTUATION:
+        return NGRAM_ALPHABET.index('.')
+    if ch in string.printable:
+        return NGRAM_ALPHABET.index('#')
+    return len(NGRAM_ALPHABET)
+
+
+# BYTE_CLASS[byte] is the index of byte's n-gram class
+BYTE_CLASS = np.array([_byte_class(byte) for byte in range(256)], dtype=np.intp)
+
+
+def count_ngrams(text, n):
+    """Count the n-grams of bytes `text`, in NGRAM_ALPHABET terms
+
+    Runs of whitespace count as a single space, and n-grams including
+    non-printable bytes aren't counted.
+    """
+    classes = ''.join(
+        NGRAM_ALPHABET[byte_class] if byte_class < len(NGRAM_ALPHABET) else '\x00'
+        for byte_class in BYTE_CLASS[np.frombuffer(text, dtype=np.uint8)]
+    )
+    classes = ' '.join(filter(None, classes.split(' ')))
+    return Counter(
+        ngram
+        for ngram in (classes[i : i + n] for i in range(len(classes) - n + 1))
+        if '\x00' not in ngram
+    )
+
+
+def _ngram_count_array(n):
+    """Counts of the n-grams, indexed by n-gram class
+
+    Counted with `count_ngrams` over the prose lines of the Python
+    documentation in the standard library's pydoc_data.topics.
+    """
+    table = load_table('ngrams{}'.format(n))
+    index = [NGRAM_ALPHABET.index(ch) for ch in table.alphabet]
+    counts = np.zeros((NGRAM_CLASSES,) * n)
+    counts[np.ix_(*[index] * n)] = table.counts
+    return counts
+
+
+@lru_cache()
+def ngram_log_probabilities(n):
+    """Array of log P(last class | previous classes), indexed by n classes
+
+    Counts are smoothed towards the prediction of the next shorter context,
+    so an unseen context falls back on it, down to the class frequencies
+    for n == 1. Non-printable bytes get the same log probability, whatever
+    their context, as they do in `byte_score_table`.
+    """
+    if n == 1:
+        counts = _ngram_count_array(2).sum(axis=0) + 1
+        probabilities = counts / counts.sum()
+    else:
+        counts = _ngram_count_array(n)
+        prior = np.exp(ngram_log_probabilities(n - 1))[np.newaxis]
+        probabilities = (counts + NGRAM_SMOOTHING * prior) / (
+            counts.sum(axis=-1, keepdims=True) + NGRAM_SMOOTHING
+        )
+    log_probabilities = np.log(probabilities)
+    log_probabilities[..., -1] = np.log(NON_PRINTABLE_PROPORTION)
+    return log_probabilities
+
+
+@lru_cache()
+def bigram_byte_table():
+    """256 x 256 array of log P(second byte | first byte)
+
+    Indexed directly by byte values, so scoring needs no class lookup.
+    """
+    log_probabilities = ngram_log_probabilities(2)
+    return log_probabilities[BYTE_CLASS[:, np.newaxis], BYTE_CLASS[np.newaxis, :]]
+
+
+def _with_word_breaks(text):
+    # treat text as starting and ending on word boundaries
+    return np.frombuffer(b' ' + bytes(text) + b' ', dtype=np.uint8)
+
+
+def bigram_score(text):
+    """Average negative log probability of each byte, given the one before
+
+    Unlike the unigram scores, this notices letters in unlikely orders.
+    """
+    text = _with_word_breaks(text)
+    return -float(bigram_byte_table()[text[:-1], text[1:]].mean())
+
+
+def trigram_score(text):
+    """Average negative log probability of each byte, given the two before"""
+    classes = BYTE_CLASS[_with_word_breaks(text)]
+    log_probabilities = ngram_log_probabilities(3)
+    return -float(log_probabilities[classes[:-2], classes[1:-1], classes[2:]].mean())
+
+
+def bigram_pair_score(firsts, seconds):
+    """Average negative log probability of each byte of `seconds` following
+    the byte at the same position in `firsts`
+
+    For scoring adjacent columns of a transposed ciphertext, where the
+    bytes of a column aren't neighbours in the plaintext.
+    """
+    n = min(len(firsts), len(seconds))
+    if not n:
+        return 0.0
+    firsts = np.frombuffer(firsts, dtype=np.uint8)[:n]
+    seconds = np.frombuffer(seconds, dtype=np.uint8)[:n]
+    return -float(bigram_byte_table()[firsts, seconds].mean())
+
+
+scoring_functions = (
+    simple_score,
+    letter_freq_score,
+    ord_average_score,
+    byte_freq_score,
+)
+# these score letters in context: they don't share all the invariants above,
+# e.g. a run of rare symbols can beat an unlikely run of letters
+ngram_scoring_functions = (bigram_score, trigram_score)
 
 
 def param_by_score_functions(xfails=()):
@@ -131,7 +359,9 @@ def test_score_letter_v_letter_equal(score_func):
     assert score_func(b'aeio') == score_func(b'zqxj')
 
 
-@param_by_functions('score_func', [letter_freq_score, ord_average_score])
+@param_by_functions(
+    'score_func', [letter_freq_score, ord_average_score, byte_freq_score]
+)
 def test_score_letter_v_letter(score_func):
     assert score_func(b'aeio') < score_func(b'zqxj')
 
@@ -196,3 +426,75 @@ def test_find_plaintext_example():
     assert plaintext == b"Cooking MC's like a pound of bacon"
     n = len(decode_hex(input_hex))
     assert decode_hex(xor_hex(input_hex, b16encode(n * b'X'))) == plaintext
+
+    ciphertext = decode_hex(input_hex)
+    assert find_xor_plaintext_bytes(ciphertext) == (b'X', plaintext)
+    plaintexts = single_letter_xor_plaintexts_bytes(ciphertext)
+    assert plaintexts[plaintext] == 'X'
+    assert plaintexts == single_letter_xor_plaintexts(input_hex)
+
+
+def test_rank_single_byte_xor_keys():
+    plaintext = b"Cooking MC's like a pound of bacon"
+    for key in (0, 88, 200, 255):
+        ciphertext = xor(plaintext, bytes([key]))
+        ranked = rank_single_byte_xor_keys(ciphertext, top_k=3)
+        assert len(ranked) == 3
+        assert ranked[0] == (key, byte_freq_score(plaintext))
+        assert ranked[0][1] < ranked[1][1] <= ranked[2][1]
+        assert break_single_byte_xor(ciphertext)[:2] == (key, plaintext)
+
+
+def test_rank_single_byte_xor_keys_empty():
+    assert break_single_byte_xor(b'') == (0, b'', 0.0)
+    assert byte_freq_score(b'') == 0.0
+
+
+@param_by_functions('score_func', ngram_scoring_functions)
+def test_ngram_score_punctuation_v_control(score_func):
+    assert score_func(b'!@#$') < score_func(b'\x00\x01\x02\x03')
+
+
+@param_by_functions('score_func', ngram_scoring_functions)
+def test_ngram_score_english_v_gibberish(score_func):
+    assert score_func(b'hello there') < score_func(b'zqxj vkwpq')
+    assert score_func(b'hello there') < score_func(b'hello\x00there')
+    # English of any length beats the same letters in a random order
+    for text in (b'the', b'hello there', b'Hello this is honestly some real text'):
+        shuffled = bytes(sorted(text))
+        assert score_func(text) < score_func(shuffled)
+
+
+@param_by_functions('score_func', ngram_scoring_functions)
+def test_ngram_score_letter_order(score_func):
+    # same letters, so the unigram scores can't tell these apart
+    assert byte_freq_score(b'the cat sat') == byte_freq_score(b'hte tca ats')
+    assert score_func(b'the cat sat') < score_func(b'hte tca ats')
+    assert score_func(b'THE CAT SAT') == score_func(b'the cat sat')
+
+
+def test_ngram_tables():
+    for n in (1, 2, 3):
+        log_probabilities = ngram_log_probabilities(n)
+        assert log_probabilities.shape == (NGRAM_CLASSES,) * n
+        assert np.isfinite(log_probabilities).all()
+    table = bigram_byte_table()
+    assert table[ord('q'), ord('u')] > table[ord('q'), ord('z')]
+
+
+def test_bigram_pair_score():
+    firsts, seconds = b'ttq', b'hhu'
+    assert bigram_pair_score(firsts, seconds) < bigram_pair_score(seconds, firsts)
+    assert bigram_pair_score(firsts, seconds + b'xyz') == bigram_pair_score(
+        firsts, seconds
+    )
+    assert bigram_pair_score(b'', seconds) == 0.0
+
+
+def test_count_ngrams():
+    counts = count_ngrams(b'To be,\n  or\x00 not', 2)
+    assert counts['TO'] == counts['O '] == counts['BE'] == 1
+    assert counts['E.'] == counts['. '] == 1
+    assert counts[' O'] == counts['OR'] == 1
+    assert 'R ' not in counts
+    assert counts[' N'] == 1
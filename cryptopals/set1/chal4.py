@@ -7,23 +7,84 @@ Find it.
 (Your code from #3 should help.)
 """
 
+import heapq
 from base64 import b16encode
+from collections import namedtuple
+from functools import partial
+from itertools import chain, islice
 
-from ..utils import decode_hex, xor_hex
-from .chal3 import select_most_englishest, simple_score, single_letter_xor_plaintexts
+from ..tracing import count, traced
+from ..utils import bounded_map, decode_hex, xor, xor_hex
+from .chal3 import break_single_byte_xor
+
+
+TOP_K = 10
+# lines per task, when scanning with workers
+SHARD_LINES = 10000
+
+XorLine = namedtuple('XorLine', 'line_no ciphertext key plaintext score')
+
+
+def _top_lines(numbered_lines, top_k):
+    """Heap of the `top_k` best XorLines, as (-score, -line_no, XorLine) tuples
+
+    Negated, so that the worst line kept is at the top of the heap, ready
+    to be replaced, and ties go to the earlier line.
+    """
+    heap = []
+    n_lines = 0
+    for line_no, ciphertext in numbered_lines:
+        n_lines += 1
+        key, plaintext, score = break_single_byte_xor(ciphertext)
+        item = (-score, -line_no, XorLine(line_no, ciphertext, key, plaintext, score))
+        if len(heap) < top_k:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+    count('chal4.lines', n_lines)
+    return heap
+
+
+@traced('chal4.scan_single_character_xor')
+def scan_single_character_xor_bytes(ciphertexts, top_k=TOP_K, workers=None):
+    """Find the ciphertexts most likely to be English XOR'd with one character
+
+    `ciphertexts` are read lazily and only the `top_k` best are kept, so
+    memory doesn't grow with the number of them. Empty ones are skipped.
+    Pass `workers` to score shards of them in that many processes. Returns
+    XorLines, numbered from 1, best first.
+    """
+    numbered_lines = (
+        (line_no, ciphertext)
+        for line_no, ciphertext in enumerate(ciphertexts, start=1)
+        if ciphertext
+    )
+    if workers and workers > 1:
+        shards = iter(lambda: list(islice(numbered_lines, SHARD_LINES)), [])
+        heaps = bounded_map(partial(_top_lines, top_k=top_k), shards, workers)
+        items = chain.from_iterable(heaps)
+    else:
+        items = _top_lines(numbered_lines, top_k)
+    return [xor_line for _, _, xor_line in heapq.nlargest(top_k, items)]
+
+
+def scan_single_character_xor(lines, top_k=TOP_K, workers=None):
+    """`scan_single_character_xor_bytes` of `lines` of hex, e.g. an open file"""
+    ciphertexts = (decode_hex(line.strip()) for line in lines)
+    return scan_single_character_xor_bytes(ciphertexts, top_k, workers)
+
+
+def decrypt_single_character_xor_bytes(ciphertexts):
+    """return (ciphertext, letter, message plaintext) bytes tuple"""
+    [best] = scan_single_character_xor_bytes(ciphertexts, top_k=1)
+    return best.ciphertext, bytes([best.key]), best.plaintext
 
 
 def decrypt_single_character_xor(encrypted_hex):
     """return (hex_string, letter, message plaintext) tuple"""
-    encrypted_lines_hex = encrypted_hex.splitlines()
-    plaintext_map = {
-        plaintext: (hex_string, letter)
-        for hex_string in encrypted_lines_hex
-        for plaintext, letter in single_letter_xor_plaintexts(hex_string).items()
-    }
-    plaintext = select_most_englishest(plaintext_map.keys(), score_func=simple_score)
-    hex_string, letter = plaintext_map[plaintext]
-    return hex_string, letter.encode(), plaintext
+    ciphertexts = map(decode_hex, encrypted_hex.split())
+    ciphertext, letter, plaintext = decrypt_single_character_xor_bytes(ciphertexts)
+    return ciphertext.hex(), letter, plaintext
 
 
 def test_decrypt_single_character_xor_from_file():
@@ -41,3 +102,38 @@ def test_decrypt_single_character_xor_from_file():
     # check answer, using the fact that if encryp^char=plain then plain^char=encryp
     encryped_hex = xor_hex(expected_answer_hex, b16encode(n * expected_single_char))
     assert encryped_hex == hex_string
+
+
+def test_scan_single_character_xor():
+    with open('cryptopals/set1/chal4_data.txt') as f:
+        best, *others = scan_single_character_xor(f, top_k=3)
+    assert len(others) == 2
+    assert best.plaintext == b"Now that the party is jumping\n"
+    assert best.key == ord('5')
+    assert best.line_no == 171
+    assert best.score < others[0].score <= others[1].score
+
+
+def test_decrypt_single_character_xor_bytes():
+    ciphertexts = [xor(b'qzj xkcd vbn', b'Y'), b'', xor(b'hello there', b'5')]
+    assert decrypt_single_character_xor_bytes(ciphertexts) == (
+        ciphertexts[2],
+        b'5',
+        b'hello there',
+    )
+
+
+def test_scan_single_character_xor_duplicates():
+    line = xor(b'hello there', b'5').hex()
+    lines = ['', line, line, '00ff' * 5 + '00']
+    results = scan_single_character_xor(lines, top_k=2)
+    # same plaintext, on different lines
+    assert [result.line_no for result in results] == [2, 3]
+
+
+def test_scan_single_character_xor_workers(mocker):
+    mocker.patch('cryptopals.set1.chal4.SHARD_LINES', 50)
+    with open('cryptopals/set1/chal4_data.txt') as f:
+        serial = scan_single_character_xor(f, top_k=5)
+    with open('cryptopals/set1/chal4_data.txt') as f:
+        assert scan_single_character_xor(f, top_k=5, workers=2) == serial
@@ -20,20 +20,75 @@ Encrypt your mail. Encrypt your password file. Your .sig file. Get a feel for it
 I promise, we aren't wasting your time with this.
 """
 
-from base64 import b16encode
-from itertools import cycle
+import io
 from textwrap import dedent
 
-from ..utils import xor_hex
+import pytest
 
+from ..utils import xor
 
-def repeating_key_xor(plaintext, key):
-    key_gen = cycle(key)
 
-    return ''.join(
-        xor_hex(b16encode(bytes([char])), b16encode(bytes([key_char])))
-        for char, key_char in zip(plaintext, key_gen)
-    ).encode()
+# the key is tiled out to at least this many bytes, XORed a tile at a time
+KEY_TILE_SIZE = 2 ** 16
+# how much of a file to read at once when streaming
+CHUNK_SIZE = 2 ** 20
+
+
+class RepeatingKeyXor:
+    """Repeating-key XOR of a stream, fed to `update` in chunks of any size
+
+    The key's phase carries on from one chunk to the next, starting from
+    byte `offset` of the stream. Chunks are XORed against slices of the key
+    tiled out to a whole number of repeats, rather than a byte at a time.
+    """
+
+    def __init__(self, key, offset=0):
+        assert key
+        self.key = key
+        repeats = -(-KEY_TILE_SIZE // len(key))
+        self.period = repeats * len(key)
+        # an extra repeat, so there's a whole period from any phase
+        self._tiled = memoryview(key * (repeats + 1))
+        self.position = offset
+
+    def update(self, data):
+        n = len(data)
+        data = memoryview(data)
+        out = bytearray(n)
+        out_view = memoryview(out)
+        phase = self.position % len(self.key)
+        # whole periods leave the phase unchanged
+        for start in range(0, n, self.period):
+            stop = min(start + self.period, n)
+            key = self._tiled[phase : phase + stop - start]
+            xor(data[start:stop], key, out=out_view[start:stop])
+        self.position += n
+        return bytes(out)
+
+
+def repeating_key_xor_file(
+    in_file, out_file, key, chunk_size=CHUNK_SIZE, hex_output=False
+):
+    """XOR binary file object `in_file` into `out_file`, a chunk at a time
+
+    Writes lower case hex if `hex_output`, else the raw bytes.
+    """
+    crypter = RepeatingKeyXor(key)
+    for chunk in iter(lambda: in_file.read(chunk_size), b''):
+        result = crypter.update(chunk)
+        out_file.write(result.hex().encode() if hex_output else result)
+
+
+def repeating_key_xor_bytes(plaintext, key):
+    "XOR `plaintext` with `key` repeated to cover it, returning bytes"
+    if len(plaintext) <= KEY_TILE_SIZE:
+        return xor(plaintext, key[: len(plaintext)])
+    return RepeatingKeyXor(key).update(plaintext)
+
+
+def repeating_key_xor(plaintext, key):
+    "As `repeating_key_xor_bytes`, but returning lower case hex bytes"
+    return repeating_key_xor_bytes(plaintext, key).hex().encode()
 
 
 def test_repeating_key_xor_example():
@@ -66,3 +121,42 @@ def test_repeating_key_xor_simple():
     int_result = int(repeating_key_xor(b'pt', b'k'), 16)
     expected = (ord('p') ^ ord('k')) * 16 ** 2 + ord('t') ^ ord('k')
     assert int_result == expected
+
+
+def test_repeating_key_xor_bytes():
+    expected = bytes([ord('p') ^ ord('k'), ord('t') ^ ord('k')])
+    assert repeating_key_xor_bytes(b'pt', b'k') == expected
+    assert repeating_key_xor_bytes(b'barbar', b'bar') == bytes(6)
+    # a key longer than the plaintext
+    assert repeating_key_xor_bytes(b'p', b'kk') == bytes([ord('p') ^ ord('k')])
+    assert repeating_key_xor_bytes(b'', b'key') == b''
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 100])
+@pytest.mark.parametrize('offset', [0, 1, 5])
+def test_repeating_key_xor_stream(mocker, chunk_size, offset):
+    # a small tile, so chunks span several periods
+    mocker.patch('cryptopals.set1.chal5.KEY_TILE_SIZE', 4)
+    key = b'ICE'
+    plaintext = bytes(range(50))
+    crypter = RepeatingKeyXor(key, offset)
+    assert crypter.period == 6
+    chunks = [plaintext[i : i + chunk_size] for i in range(0, 50, chunk_size)]
+    result = b''.join(crypter.update(chunk) for chunk in chunks)
+    expected = xor(bytes(offset) + plaintext, key)[offset:]
+    assert result == expected
+    assert crypter.position == offset + 50
+
+
+def test_repeating_key_xor_file(mocker):
+    mocker.patch('cryptopals.set1.chal5.KEY_TILE_SIZE', 8)
+    key = b'Terminator X: Bring the noise'
+    plaintext = bytes(range(256)) * 4
+    out_file = io.BytesIO()
+    repeating_key_xor_file(io.BytesIO(plaintext), out_file, key, chunk_size=10)
+    assert out_file.getvalue() == repeating_key_xor_bytes(plaintext, key)
+    assert repeating_key_xor_bytes(plaintext, key) == xor(plaintext, key)
+
+    out_file = io.BytesIO()
+    repeating_key_xor_file(io.BytesIO(plaintext), out_file, key, 7, hex_output=True)
+    assert out_file.getvalue() == repeating_key_xor(plaintext, key)
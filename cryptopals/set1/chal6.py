@@ -51,13 +51,27 @@ there aren't any blatant errors in this text. In particular: the "wokka wokka!!!
 distance
 really is 37.
 """
+import math
 import re
 from base64 import b16encode, b64decode
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from itertools import chain
 from textwrap import dedent
 
-from ..utils import decode_hex
-from .chal4 import decrypt_single_character_xor
-from .chal5 import repeating_key_xor
+import numpy as np
+import pytest
+
+from ..tracing import span, traced
+from ..utils import bounded_map, xor
+from .chal3 import (
+    BYTE_CLASS,
+    byte_freq_score,
+    ngram_log_probabilities,
+    rank_single_byte_xor_keys,
+)
 
 
 def str_to_bin(s):
@@ -67,25 +81,49 @@ def str_to_bin(s):
     return '{:0{}b}'.format(result_int, 8 * len(s))
 
 
+MAX_KEYSIZE = 40
+# how many of the best ranked keysizes to solve
+TOP_KEYSIZES = 3
+# how many of each column's best single byte XOR keys `refine_key` considers
+KEY_CANDIDATES = 5
+REFINE_PASSES = 3
+# refine_key looks at only this many keysize rows, plenty to choose each byte
+REFINE_ROWS = 256
+# below this many bytes, ranking the columns in workers costs more than it saves
+PARALLEL_COLUMNS_MIN_SIZE = 2 ** 24
+# a column whose key byte beats the runner up by less than this is weak
+WEAK_MARGIN = 0.5
+
+KeysizeRank = namedtuple('KeysizeRank', 'keysize distance margin')
+# margin is the runner up candidate's score less key_byte's: negative when
+# refine_key overruled the column's own best
+ColumnResult = namedtuple('ColumnResult', 'column key_byte score margin')
+
+# POPCOUNT[byte] is the number of bits set in byte
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
 def hamming_distance(str1, str2):
     # no support for differing length inputs at the moment
     assert len(str1) == len(str2)
-    return len(
-        [None for bit1, bit2 in zip(str_to_bin(str1), str_to_bin(str2)) if bit1 != bit2]
-    )
+    # count the bits set in the XOR: the differing ones
+    return bin(int.from_bytes(xor(str1, str2), 'big')).count('1')
+
+
+def hamming_matrix(blocks):
+    """Matrix of the Hamming distance between each pair of equal length blocks"""
+    block_len = len(blocks[0]) if blocks else 0
+    array = np.frombuffer(b''.join(blocks), dtype=np.uint8)
+    array = array.reshape(len(blocks), block_len)
+    differing = array[:, np.newaxis, :] ^ array[np.newaxis, :, :]
+    return POPCOUNT[differing].sum(axis=2, dtype=np.int64)
 
 
 def keysize_to_hamming_distance(keysize, text):
-    block_distances = [
-        # compare blocks 0:2 v 2:4, 2:4 v 4:6
-        hamming_distance(
-            text[keysize * n : keysize * n + keysize],
-            text[keysize * n + keysize : keysize * n + keysize * 2],
-        )
-        / keysize
-        for n in range(10)
-    ]
-    return sum(block_distances) / len(block_distances)
+    # compare blocks 0:2 v 2:4, 2:4 v 4:6
+    blocks = [text[keysize * n : keysize * n + keysize] for n in range(11)]
+    block_distances = np.diagonal(hamming_matrix(blocks), offset=1) / keysize
+    return block_distances.mean()
 
 
 def best_keysize_via_hamming_distance(bytes_encrypted):
@@ -95,19 +133,256 @@ def best_keysize_via_hamming_distance(bytes_encrypted):
     )
 
 
+def mean_pairwise_hamming_distance(blocks):
+    """Mean Hamming distance over every pair of equal length `blocks`
+
+    The same as averaging the upper triangle of `hamming_matrix`, without
+    building it: if c of the n blocks have a given bit set, that bit
+    differs between c * (n - c) pairs.
+    """
+    n = len(blocks)
+    if n < 2:
+        return 0.0
+    array = np.frombuffer(b''.join(blocks), dtype=np.uint8).reshape(n, -1)
+    bits_set = np.unpackbits(array, axis=1).sum(axis=0, dtype=np.int64)
+    differing_pairs = (bits_set * (n - bits_set)).sum()
+    return differing_pairs / (n * (n - 1) / 2)
+
+
+def rank_keysizes(bytes_encrypted, max_keysize=MAX_KEYSIZE):
+    """Rank keysizes 2 to `max_keysize` by normalised Hamming distance
+
+    Unlike `keysize_to_hamming_distance`, every pair of keysize blocks is
+    compared. Keysizes without two whole blocks to compare aren't ranked.
+    Returns KeysizeRanks, best (lowest distance) first, with the margin by
+    which each beats the next.
+    """
+    distances = {}
+    max_keysize = min(max_keysize, len(bytes_encrypted) // 2)
+    for keysize in range(2, max_keysize + 1):
+        n_blocks = len(bytes_encrypted) // keysize
+        blocks = [
+            bytes_encrypted[keysize * n : keysize * (n + 1)] for n in range(n_blocks)
+        ]
+        distances[keysize] = mean_pairwise_hamming_distance(blocks) / keysize
+    ranked = sorted(distances, key=distances.get)
+    margins = [
+        distances[next_keysize] - distances[keysize]
+        for keysize, next_keysize in zip(ranked, ranked[1:])
+    ]
+    return [
+        KeysizeRank(keysize, float(distances[keysize]), float(margin))
+        for keysize, margin in zip(ranked, margins + [0.0])
+    ]
+
+
 def skips_by_keysize(s, keysize):
     return [s[start::keysize] for start in range(keysize)]
 
 
-def decrypt_repeating_key_xor(bytes_encrypted):
-    best_keysize = best_keysize_via_hamming_distance(bytes_encrypted)
-    skips_blocks = skips_by_keysize(bytes_encrypted, best_keysize)
+@traced('chal6.refine_key')
+def refine_key(bytes_encrypted, candidates, passes=REFINE_PASSES):
+    """Choose each key byte from its column's `candidates`, return the key
+
+    Scoring each column on its own byte frequencies often picks the wrong
+    key byte for short columns. Instead, take each column in turn and keep
+    the candidate giving the whole plaintext the best `trigram_score`, as
+    neighbouring plaintext bytes come from neighbouring columns. Only the
+    trigrams including the column's bytes are rescored. Repeats until no
+    byte changes, or for `passes` passes.
+    """
+    keysize = len(candidates)
+    key = bytearray(column[0] for column in candidates)
+    # plaintext byte i is classes[i + 1], between word breaks like trigram_score
+    ciphertext = np.frombuffer(b' ' + bytes_encrypted + b' ', dtype=np.uint8)
+    # a key longer than the ciphertext has columns with nothing in them
+    plaintext = b' ' + xor(bytes_encrypted, bytes(key[: len(bytes_encrypted)])) + b' '
+    classes = BYTE_CLASS[np.frombuffer(plaintext, dtype=np.uint8)]
+    log_probabilities = ngram_log_probabilities(3)
+
+    for _ in range(passes):
+        changed = False
+        for pos, column in enumerate(candidates):
+            positions = np.arange(pos + 1, len(classes) - 1, keysize)
+            # the trigrams including a byte of the column, by start
+            rescored = np.zeros(len(classes), dtype=bool)
+            for offset in range(3):
+                rescored[positions - offset] = True
+            starts = np.flatnonzero(rescored[:-2])
+
+            def cost(key_byte):
+                classes[positions] = BYTE_CLASS[ciphertext[positions] ^ key_byte]
+                trigrams = classes[starts], classes[starts + 1], classes[starts + 2]
+                return -log_probabilities[trigrams].sum()
+
+            best = min(column, key=cost)
+            classes[positions] = BYTE_CLASS[ciphertext[positions] ^ best]
+            changed |= best != key[pos]
+            key[pos] = best
+        if not changed:
+            break
+    return bytes(key)
+
+
+def _rank_column_chunk(columns, top_k):
+    return [rank_single_byte_xor_keys(column, top_k) for column in columns]
+
+
+@traced('chal6.rank_columns')
+def rank_columns(
+    bytes_encrypted,
+    keysize,
+    top_k=KEY_CANDIDATES,
+    workers=None,
+    chunk_columns=None,
+    executor_class=ProcessPoolExecutor,
+    executor=None,
+):
+    """Each column's `top_k` best (key byte, score) as single byte XOR
+
+    The columns are independent, so with `workers` they're ranked in chunks
+    of `chunk_columns`, by default enough for about four chunks per worker,
+    in a new `executor_class` pool or the running `executor` given.
+    Ciphertexts under PARALLEL_COLUMNS_MIN_SIZE bytes are ranked serially.
+    """
+    columns = skips_by_keysize(bytes_encrypted, keysize)
+    rank_chunk = partial(_rank_column_chunk, top_k=top_k)
+    if not workers or workers < 2 or len(bytes_encrypted) < PARALLEL_COLUMNS_MIN_SIZE:
+        return rank_chunk(columns)
+    chunk_columns = chunk_columns or -(-keysize // (4 * workers))
+    chunks = [
+        columns[start : start + chunk_columns]
+        for start in range(0, keysize, chunk_columns)
+    ]
+    rankings = bounded_map(rank_chunk, chunks, workers, executor_class, executor)
+    return list(chain.from_iterable(rankings))
+
+
+def solve_columns(bytes_encrypted, keysize, top_k=KEY_CANDIDATES, **rank_kwargs):
+    """return a ColumnResult for each key byte
+
+    Ranks the columns with `rank_columns`, passed `rank_kwargs`, then
+    chooses between each column's `top_k` best with `refine_key`, over the
+    first REFINE_ROWS rows of the ciphertext.
+    """
+    # at least the runner up, for the margin
+    rankings = rank_columns(bytes_encrypted, keysize, max(top_k, 2), **rank_kwargs)
+    candidates = [[key_byte for key_byte, _ in ranking[:top_k]] for ranking in rankings]
+    key = refine_key(bytes_encrypted[: keysize * REFINE_ROWS], candidates)
+    results = []
+    for column, (key_byte, ranking) in enumerate(zip(key, rankings)):
+        scores = dict(ranking)
+        score = scores.pop(key_byte)
+        margin = min(scores.values(), default=math.inf) - score
+        results.append(ColumnResult(column, key_byte, score, margin))
+    return results
+
+
+def weak_columns(results, min_margin=WEAK_MARGIN):
+    "The ColumnResults whose key byte was a close call, or overruled"
+    return [result for result in results if result.margin < min_margin]
+
+
+def decrypt_with_keysize(
+    bytes_encrypted,
+    keysize,
+    top_k=KEY_CANDIDATES,
+    workers=None,
+    executor=None,
+    return_columns=False,
+):
+    """return (key, plaintext), or with `return_columns` (key, plaintext,
+    columns), the ColumnResult of each key byte from `solve_columns`
+
+    Ranks each key byte independently as single byte XOR, in `workers`
+    processes if given, in the running `executor` if given, then chooses
+    between each byte's `top_k` best with `refine_key`.
+    """
+    with span('chal6.decrypt_with_keysize', keysize=keysize):
+        columns = solve_columns(
+            bytes_encrypted, keysize, top_k, workers=workers, executor=executor
+        )
+        key = bytes(result.key_byte for result in columns)
+        plaintext = xor(bytes_encrypted, key[: len(bytes_encrypted)])
+        if return_columns:
+            return key, plaintext, columns
+        return key, plaintext
+
+
+@traced('chal6.candidate_keysizes')
+def candidate_keysizes(bytes_encrypted, top_k=TOP_KEYSIZES, max_keysize=MAX_KEYSIZE):
+    """The `top_k` best ranked keysizes, and their divisors
+
+    A multiple of the real keysize looks as good as the keysize itself,
+    and on short ciphertexts often better.
+    """
+    ranks = rank_keysizes(bytes_encrypted, max_keysize)[:top_k]
+    return sorted(
+        {
+            divisor
+            for rank in ranks
+            for divisor in range(2, rank.keysize + 1)
+            if rank.keysize % divisor == 0
+        }
+    )
+
+
+@traced('chal6.solution_cost')
+def solution_cost(solution):
+    """How unlikely a (key, plaintext[, columns]) solution is, lower is better
 
-    letters = list(
-        zip(*[decrypt_single_character_xor(b16encode(block)) for block in skips_blocks])
-    )[1]
-    key = b''.join(letters)
-    return key, decode_hex(repeating_key_xor(bytes_encrypted, key))
+    The plaintext's total `byte_freq_score`, plus the cost of describing
+    each key byte, so that longer keys have to earn their extra freedom.
+    """
+    key, plaintext = solution[:2]
+    return byte_freq_score(plaintext) * len(plaintext) + len(key) * math.log(256)
+
+
+@traced('chal6.decrypt_repeating_key_xor')
+def decrypt_repeating_key_xor(
+    bytes_encrypted,
+    top_k=TOP_KEYSIZES,
+    max_keysize=MAX_KEYSIZE,
+    workers=None,
+    column_workers=None,
+    return_columns=False,
+):
+    """return (key, plaintext), or with `return_columns` (key, plaintext,
+    columns), the ColumnResult of each key byte, to check for `weak_columns`
+
+    Fully solves each of the `candidate_keysizes`, in `workers` processes
+    if given, and keeps the solution with the lowest `solution_cost`. For
+    long keys, pass `column_workers` instead, to rank each keysize's
+    columns in a pool of that many processes. Passing both is a ValueError.
+    """
+    parallel_keysizes = workers and workers > 1
+    if parallel_keysizes and column_workers:
+        raise ValueError('pass workers or column_workers, not both')
+    if not bytes_encrypted:
+        return (b'', b'', []) if return_columns else (b'', b'')
+    # too short to compare two blocks of any keysize, try a single byte key
+    keysizes = candidate_keysizes(bytes_encrypted, top_k, max_keysize) or [1]
+    parallel_columns = (
+        column_workers
+        and column_workers > 1
+        and len(bytes_encrypted) >= PARALLEL_COLUMNS_MIN_SIZE
+    )
+    # one pool for every keysize's columns
+    pool = ProcessPoolExecutor(column_workers) if parallel_columns else nullcontext()
+    with pool as executor:
+        solve = partial(
+            decrypt_with_keysize,
+            bytes_encrypted,
+            workers=column_workers,
+            executor=executor,
+            return_columns=True,
+        )
+        if parallel_keysizes:
+            solutions = bounded_map(solve, keysizes, workers)
+        else:
+            solutions = map(solve, keysizes)
+        solution = min(solutions, key=solution_cost)
+    return solution if return_columns else solution[:2]
 
 
 def test_skips_by_keysize_simple():
@@ -130,6 +405,16 @@ def test_hamming_identity():
     assert hamming_distance(b'identity $%^', b'identity $%^') == 0
 
 
+def test_hamming_empty():
+    assert hamming_distance(b'', b'') == 0
+
+
+def test_hamming_matrix():
+    blocks = [b'this is a test', b'wokka wokka!!!', b'this is a tesu']
+    assert hamming_matrix(blocks).tolist() == [[0, 37, 1], [37, 0, 36], [1, 36, 0]]
+    assert hamming_matrix([]).shape == (0, 0)
+
+
 def test_hamming_zero_truncation():
     # 00111111', 01000001
     assert hamming_distance(b'?', b'A') == 6
@@ -183,6 +468,170 @@ def test_keysize_to_hamming_distance_example():
     assert best_keysize == 29
 
 
+def test_mean_pairwise_hamming_distance():
+    blocks = [b'this is a test', b'wokka wokka!!!', b'this is a tesu']
+    assert mean_pairwise_hamming_distance(blocks) == (37 + 1 + 36) / 3
+    assert mean_pairwise_hamming_distance(blocks[:1]) == 0.0
+
+
+def test_rank_keysizes():
+    b64_encrypted = open('cryptopals/set1/chal6.txt', 'rb').read()
+    bytes_encrypted = b64decode(b64_encrypted)
+    best, runner_up, *_ = ranked = rank_keysizes(bytes_encrypted, max_keysize=30)
+    assert len(ranked) == 29
+    assert best.keysize == 29
+    assert best.margin == runner_up.distance - best.distance > 0
+
+
+def test_decrypt_repeating_key_xor_short_ciphertext(mocker):
+    plaintext = dedent(
+        """
+        Solve each block as if it was single-character XOR. You already have code
+        to do this. For each block, the single-byte XOR key that produces the best
+        looking histogram is the repeating-key XOR key byte for that block.
+        """
+    ).encode()
+    bytes_encrypted = xor(plaintext, b'YELLOW')
+    # too short for the Hamming distance to tell a multiple from the keysize
+    assert rank_keysizes(bytes_encrypted)[0].keysize == 30
+    assert 6 in candidate_keysizes(bytes_encrypted)
+    assert decrypt_repeating_key_xor(bytes_encrypted) == (b'YELLOW', plaintext)
+    assert decrypt_repeating_key_xor(bytes_encrypted, workers=2) == (
+        b'YELLOW',
+        plaintext,
+    )
+    mocker.patch('cryptopals.set1.chal6.PARALLEL_COLUMNS_MIN_SIZE', 0)
+    assert decrypt_repeating_key_xor(bytes_encrypted, column_workers=2) == (
+        b'YELLOW',
+        plaintext,
+    )
+
+
+def test_decrypt_repeating_key_xor_workers_and_column_workers():
+    bytes_encrypted = xor(b'both kinds of workers', b'KEY')
+    with pytest.raises(ValueError, match='not both'):
+        decrypt_repeating_key_xor(bytes_encrypted, workers=2, column_workers=2)
+    # a single keysize worker is serial, so column workers are fine
+    assert decrypt_repeating_key_xor(
+        bytes_encrypted, workers=1, column_workers=2
+    ) == decrypt_repeating_key_xor(bytes_encrypted)
+
+
+@pytest.mark.parametrize('n', [75, 80])
+def test_decrypt_repeating_key_xor_few_blocks(n):
+    plaintext = (
+        b'Now that you have the keysize, break the ciphertext into blocks of '
+        b'keysize length.'
+    )[:n]
+    bytes_encrypted = xor(plaintext, b'SECRETKEY11')
+    # keysizes without two whole blocks can't be ranked
+    ranks = rank_keysizes(bytes_encrypted)
+    assert max(rank.keysize for rank in ranks) == n // 2
+    assert 11 in candidate_keysizes(bytes_encrypted)
+    assert 13 in candidate_keysizes(xor(plaintext, b'ABCDEFGHIJKLM'))
+    assert decrypt_repeating_key_xor(bytes_encrypted) == (b'SECRETKEY11', plaintext)
+
+
+def test_decrypt_repeating_key_xor_tiny():
+    assert rank_keysizes(b'') == []
+    assert decrypt_repeating_key_xor(b'') == (b'', b'')
+    key, plaintext = decrypt_repeating_key_xor(b'abc')
+    assert len(key) == 1
+    assert xor(plaintext, key) == b'abc'
+
+
+def test_solve_columns_keysize_beyond_ciphertext():
+    bytes_encrypted = xor(b'hello world', b'KEY')
+    results = solve_columns(bytes_encrypted, 20)
+    assert len(results) == 20
+    key, plaintext = decrypt_with_keysize(bytes_encrypted, 20)
+    assert len(key) == 20
+    assert xor(plaintext, key[:11]) == bytes_encrypted
+
+
+def test_decrypt_with_keysize_short_columns():
+    plaintext = dedent(
+        """
+        Now transpose the blocks: make a block that is the first byte of every
+        block, and a block that is the second byte of every block, and so on.
+        """
+    ).encode()
+    key = b'ICE ICE BABY'
+    bytes_encrypted = xor(plaintext, key)
+    # 13 byte columns are too short to solve by byte frequencies alone
+    unigram_key = bytes(
+        rank_single_byte_xor_keys(block, 1)[0][0]
+        for block in skips_by_keysize(bytes_encrypted, len(key))
+    )
+    assert unigram_key != key
+    assert decrypt_with_keysize(bytes_encrypted, len(key)) == (key, plaintext)
+
+    results = solve_columns(bytes_encrypted, len(key))
+    assert bytes(result.key_byte for result in results) == key
+    assert [result.column for result in results] == list(range(len(key)))
+    # the overruled columns are flagged
+    overruled = [
+        result for result in results if result.key_byte != unigram_key[result.column]
+    ]
+    assert overruled
+    assert all(result.margin < 0 for result in overruled)
+    assert set(overruled) <= set(weak_columns(results))
+
+
+def test_solve_columns_long_ciphertext():
+    b64_encrypted = open('cryptopals/set1/chal6.txt', 'rb').read()
+    bytes_encrypted = b64decode(b64_encrypted)
+    results = solve_columns(bytes_encrypted, 29)
+    key = bytes(result.key_byte for result in results)
+    assert key == b'Terminator X: Bring the noise'
+    assert weak_columns(results) == []
+    assert all(result.margin > 0 and result.score > 0 for result in results)
+
+
+@pytest.mark.parametrize('executor_class', [ThreadPoolExecutor, ProcessPoolExecutor])
+@pytest.mark.parametrize('chunk_columns', [None, 1, 4, 100])
+def test_rank_columns_workers(mocker, executor_class, chunk_columns):
+    mocker.patch('cryptopals.set1.chal6.PARALLEL_COLUMNS_MIN_SIZE', 0)
+    bytes_encrypted = xor(b'ten column ciphertext, ' * 10, b'0123456789')
+    serial = rank_columns(bytes_encrypted, 10)
+    assert len(serial) == 10
+    assert serial == rank_columns(
+        bytes_encrypted,
+        10,
+        workers=2,
+        chunk_columns=chunk_columns,
+        executor_class=executor_class,
+    )
+
+
+def test_decrypt_repeating_key_xor_columns():
+    plaintext = b'Each column is a single byte XOR problem of its own. ' * 3
+    bytes_encrypted = xor(plaintext, b'YELLOW')
+    key, decrypted, columns = decrypt_repeating_key_xor(
+        bytes_encrypted, return_columns=True
+    )
+    assert (key, decrypted) == decrypt_repeating_key_xor(bytes_encrypted)
+    assert (key, decrypted) == (b'YELLOW', plaintext)
+    assert [result.column for result in columns] == list(range(6))
+    assert bytes(result.key_byte for result in columns) == key
+    assert weak_columns(columns) == []
+    assert decrypt_repeating_key_xor(b'', return_columns=True) == (b'', b'', [])
+
+
+def test_decrypt_repeating_key_xor_column_pool(mocker):
+    mocker.patch('cryptopals.set1.chal6.PARALLEL_COLUMNS_MIN_SIZE', 0)
+    pool = mocker.patch(
+        'cryptopals.set1.chal6.ProcessPoolExecutor', side_effect=ThreadPoolExecutor
+    )
+    plaintext = b'Each column is a single byte XOR problem of its own. ' * 3
+    bytes_encrypted = xor(plaintext, b'YELLOW')
+    assert len(candidate_keysizes(bytes_encrypted)) > 1
+    solution = decrypt_repeating_key_xor(bytes_encrypted, column_workers=2)
+    assert solution == (b'YELLOW', plaintext)
+    # shared by every candidate keysize
+    pool.assert_called_once_with(2)
+
+
 def test_skips_by_keysize():
     b64_encrypted = open('cryptopals/set1/chal6.txt', 'rb').read()
     bytes_encrypted = b64decode(b64_encrypted)
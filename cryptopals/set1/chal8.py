@@ -11,18 +11,24 @@ the same 16 byte plaintext block will always produce the same 16 byte ciphertext
 """
 
 import re
-from collections import Counter
-from itertools import zip_longest
+from collections import Counter, namedtuple
+from functools import partial
+from itertools import chain, islice
 
+from ..utils import bounded_map, iter_blocks
 
-# From http://stackoverflow.com/a/312644/15890
-def grouper(n, iterable, padvalue=None):
-    "grouper(3, 'abcdefg', 'x') --> ('a','b','c'), ('d','e','f'), ('g','x','x')"
-    return zip_longest(*[iter(iterable)] * n, fillvalue=padvalue)
+
+BLOCK_SIZE = 16
+# report records with a larger share of repeated blocks than this
+REPEAT_THRESHOLD = 0.0
+# records per task, when scanning with workers
+SHARD_RECORDS = 10000
+
+EcbRecord = namedtuple('EcbRecord', 'record_no offset data repeat_ratio repeat_offsets')
 
 
 def get_uniq_block_counts(cipher_lines):
-    return {line: len(set(map(bytes, grouper(16, line)))) for line in cipher_lines}
+    return {line: len(set(iter_blocks(line, 16))) for line in cipher_lines}
 
 
 def detect_ecb(line_to_uniq_chunks):
@@ -30,6 +36,89 @@ def detect_ecb(line_to_uniq_chunks):
     return ecb_line, line_to_uniq_chunks[ecb_line]
 
 
+def hex_records(lines):
+    """Lazily yield (record_no, offset, data) for each line of hex
+
+    Records are numbered from 1, and offset is where the line starts in
+    the input. Blank lines are skipped.
+    """
+    offset = 0
+    for record_no, line in enumerate(lines, start=1):
+        if line.strip():
+            yield record_no, offset, bytes.fromhex(line.strip())
+        offset += len(line)
+
+
+def fixed_records(f, record_size):
+    """Lazily yield (record_no, offset, data) for each `record_size` bytes
+    read from binary file `f`
+    """
+    for record_no, data in enumerate(iter(partial(f.read, record_size), b''), 1):
+        yield record_no, (record_no - 1) * record_size, data
+
+
+class RepeatedBlocks:
+    """Find the blocks of a record that repeat, one record at a time
+
+    The table of blocks seen is cleared and reused for each record, rather
+    than building a new set per record.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._first_offsets = {}
+
+    def __call__(self, data):
+        """return (repeat ratio, offsets of repeated blocks) for bytes `data`
+
+        The ratio is the share of full blocks that are a copy of an earlier
+        block, and the offsets those of every block with a copy.
+        """
+        first_offsets = self._first_offsets
+        first_offsets.clear()
+        repeat_offsets = set()
+        block_size = self.block_size
+        n_blocks = len(data) // block_size
+        for offset in range(0, n_blocks * block_size, block_size):
+            first = first_offsets.setdefault(data[offset : offset + block_size], offset)
+            if first != offset:
+                repeat_offsets.update((first, offset))
+        n_repeats = n_blocks - len(first_offsets)
+        return n_repeats / max(n_blocks, 1), sorted(repeat_offsets)
+
+
+def _scan_records(records, threshold, block_size):
+    repeated_blocks = RepeatedBlocks(block_size)
+    for record_no, offset, data in records:
+        repeat_ratio, repeat_offsets = repeated_blocks(data)
+        if repeat_ratio > threshold:
+            yield EcbRecord(record_no, offset, data, repeat_ratio, repeat_offsets)
+
+
+def _scan_shard(records, threshold, block_size):
+    return list(_scan_records(records, threshold, block_size))
+
+
+def scan_ecb_records(
+    records, threshold=REPEAT_THRESHOLD, block_size=BLOCK_SIZE, workers=None
+):
+    """Lazily yield an EcbRecord for each record likely encrypted with ECB
+
+    `records` of (record_no, offset, data), e.g. from `hex_records` or
+    `fixed_records`, are read as needed, so memory doesn't grow with the
+    input. Records whose repeat ratio is over `threshold` are yielded, in
+    input order. Pass `workers` to scan shards of records in that many
+    processes.
+    """
+    if workers and workers > 1:
+        records = iter(records)
+        shards = iter(lambda: list(islice(records, SHARD_RECORDS)), [])
+        scan = partial(_scan_shard, threshold=threshold, block_size=block_size)
+        yield from chain.from_iterable(bounded_map(scan, shards, workers))
+    else:
+        yield from _scan_records(records, threshold, block_size)
+
+
 def test_detect_ecb():
     block_len = 16
     cipher_lines = open('cryptopals/set1/chal8.txt', 'rb').read().splitlines()
@@ -76,3 +165,44 @@ def test_detect_ecb():
     )
 
     assert re.match(repeat_regex, example_pattern.decode(), re.VERBOSE)
+
+
+def test_scan_ecb_records():
+    with open('cryptopals/set1/chal8.txt') as f:
+        [ecb_record] = scan_ecb_records(hex_records(f))
+    assert ecb_record.record_no == 133
+    assert ecb_record.offset == 132 * 321
+    # 10 blocks, of which block 1 is repeated as blocks 3, 5 and 7
+    assert ecb_record.repeat_ratio == 3 / 10
+    assert ecb_record.repeat_offsets == [16, 48, 80, 112]
+    with open('cryptopals/set1/chal8.txt', 'rb') as f:
+        ecb_line = f.read().splitlines()[132]
+    assert ecb_record.data.hex().encode() == ecb_line
+
+
+def test_scan_ecb_records_threshold():
+    records = list(enumerate([b'a' * 16 * 4, b'a' * 16 + b'b' * 48, b'x' * 15], 1))
+    records = [(record_no, 0, data) for record_no, data in records]
+    results = list(scan_ecb_records(records))
+    assert [result.record_no for result in results] == [1, 2]
+    assert results[1].repeat_ratio == 2 / 4
+    assert results[1].repeat_offsets == [16, 32, 48]
+    results = list(scan_ecb_records(records, threshold=0.5))
+    assert [result.record_no for result in results] == [1]
+
+
+def test_scan_ecb_records_fixed_size(tmp_path):
+    path = tmp_path / 'capture.bin'
+    path.write_bytes(bytes(range(64)) + b'YELLOW SUBMARINE' * 4 + bytes(range(10)))
+    with open(str(path), 'rb') as f:
+        results = list(scan_ecb_records(fixed_records(f, 64)))
+    assert [(result.record_no, result.offset) for result in results] == [(2, 64)]
+    assert results[0].repeat_offsets == [0, 16, 32, 48]
+
+
+def test_scan_ecb_records_workers(mocker):
+    mocker.patch('cryptopals.set1.chal8.SHARD_RECORDS', 50)
+    with open('cryptopals/set1/chal8.txt') as f:
+        serial = list(scan_ecb_records(hex_records(f)))
+    with open('cryptopals/set1/chal8.txt') as f:
+        assert list(scan_ecb_records(hex_records(f), workers=2)) == serial
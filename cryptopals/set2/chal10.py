@@ -27,7 +27,9 @@ What's the point of even doing this stuff if you aren't going to learn from it?
 import re
 from base64 import b64decode
 
-from ..aes import decrypt_cbc
+import pytest
+
+from ..aes import CBC_ENGINES, decrypt_cbc
 
 
 expected = """
@@ -115,7 +117,8 @@ Play that funky music
 expected = re.sub(r'(\n+)', r' \1', expected).lstrip().encode()
 
 
-def test_example():
+@pytest.mark.parametrize('engine', CBC_ENGINES)
+def test_example(engine):
     crypt = open('cryptopals/set2/chal10.txt', 'rb').read()
     crypt = b64decode(crypt)
-    assert decrypt_cbc(crypt, b'YELLOW SUBMARINE') == expected
+    assert decrypt_cbc(crypt, b'YELLOW SUBMARINE', engine=engine) == expected
@@ -55,9 +55,18 @@ import string
 from base64 import b64decode
 from textwrap import dedent
 
-from ..aes import encrypt_ecb, PAD_CHAR
-from ..oracle import detect_cipher
-from ..utils import grouper, pad
+import pytest
+
+from ..aes import encrypt_cbc, encrypt_ecb, PAD_CHAR
+from ..oracle import (
+    CachedOracle,
+    detect_cipher,
+    oracle_many,
+    profile_oracle,
+    run_metered,
+)
+from ..tracing import traced
+from ..utils import pad
 
 
 CONSISTENT_KEY = b'p89Sma0YfaSwfY8y'
@@ -75,42 +84,50 @@ def encryption_oracle(plaintext, password=CONSISTENT_KEY):
     return encrypt_ecb(pad(plaintext, 16), password)
 
 
-def count_repeat_runs(blocks):
-    last = None
-    runs = [0]
-    for block in blocks:
-        if block == last:
-            runs[-1] += 1
-        elif runs[-1]:
-            runs.append(0)
-        last = block
-    return max(runs)
+def encryption_oracle_many(plaintexts, password=CONSISTENT_KEY):
+    """Batch form of `encryption_oracle`
+
+    ECB encrypts each block independently, so we can encrypt all the padded
+    messages in one call, and split the ciphertext up afterwards.
+    """
+    suffex = b64decode(UNKNOWN_STRING)
+    padded = [pad(plaintext + suffex, 16) for plaintext in plaintexts]
+    ciphertext = encrypt_ecb(b''.join(padded), password)
+    ciphertexts = []
+    start = 0
+    for message in padded:
+        ciphertexts.append(ciphertext[start : start + len(message)])
+        start += len(message)
+    return ciphertexts
+
+
+encryption_oracle.many = encryption_oracle_many
 
 
-def test_count_repeat_runs():
-    # Don't count the first character in a run
-    assert count_repeat_runs('abcabc') == 0
-    assert count_repeat_runs('abccabc') == 1
-    assert count_repeat_runs('abbcccabb') == 2
+def test_encryption_oracle_many():
+    plaintexts = [b'', b'A', b'A' * 16, b'ABC' * 20]
+    assert encryption_oracle_many(plaintexts) == [
+        encryption_oracle(plaintext) for plaintext in plaintexts
+    ]
 
 
 def detect_block_size(encryption_func=encryption_oracle):
-    # can detect block sizes half this length and under
-    text_len = 512
-    plaintext = b'A' * text_len
-    ciphertext = encryption_func(plaintext)
-    half_len = len(ciphertext) // 2
-    for i in range(2, half_len):
-        blocks = list(grouper(i, ciphertext))
-        num_repeat_runs = count_repeat_runs(blocks)
-        if num_repeat_runs:
-            return i
+    return profile_oracle(encryption_func).block_size
 
 
 def test_detect_block_size():
     assert detect_block_size() == 16
 
 
+def test_profile_oracle():
+    profile = profile_oracle(encryption_oracle)
+    assert profile.block_size == 16
+    assert profile.is_ecb
+    assert profile.prefix_len == 0
+    assert profile.suffix_len == len(b64decode(UNKNOWN_STRING))
+    assert detect_cipher(encryption_oracle, profile)
+
+
 def test_detect_cipher():
     is_ecb = detect_cipher(encryption_oracle)
     assert is_ecb
@@ -121,10 +138,14 @@ def get_block(data, block_size, block_num):
     stop = start + block_size
     return data[start:stop]
 
+
 ALPHABET = PAD_CHAR.decode() + string.printable
 
 
-def ecb_decrypt_char(block_size, pos, known):
+@traced('chal12.ecb_decrypt_char')
+def ecb_decrypt_char(
+    block_size, pos, known, encryption_func=encryption_oracle, prefix_len=0
+):
     '''
     aaa X=a-z
     aaa<S=1
@@ -143,33 +164,54 @@ def ecb_decrypt_char(block_size, pos, known):
 
     aa12 345 X
     aa12 345<S
+
+    A prefix is first topped up to a whole number of blocks.
     '''
     offset = pos % block_size
-    block_num = pos // block_size
+    prefix_blocks = -(-prefix_len // block_size)
+    block_num = prefix_blocks + pos // block_size
     pad_len = block_size - offset - 1
 
+    lead = b'A' * (prefix_blocks * block_size - prefix_len)
     base = 'A' * pad_len
 
     inputs = [base + known + letter for letter in ALPHABET]
+    # one batch: every candidate, then the base itself
+    *candidate_crypts, base_crypt = oracle_many(
+        encryption_func, [lead + input.encode() for input in inputs + [base]]
+    )
     crypt_lookup = {
-        get_block(encryption_oracle(input.encode()), block_size, block_num): input[-1]
-        for input in inputs
+        get_block(candidate_crypt, block_size, block_num): input[-1]
+        for input, candidate_crypt in zip(inputs, candidate_crypts)
     }
 
-    crypt = get_block(encryption_oracle(base.encode()), block_size, block_num)
+    crypt = get_block(base_crypt, block_size, block_num)
 
     return crypt_lookup[crypt]
 
 
-def ecb_decrypt():
-    unknowns_len = len(encryption_oracle(b''))
-    block_size = detect_block_size()
+@traced('chal12.ecb_decrypt')
+def ecb_decrypt(encryption_func=encryption_oracle, profile=None):
+    """Recover the oracle's secret suffix
+
+    Oracle responses are cached, as each input is repeated for every
+    block of the secret. Pass your own `CachedOracle` to see the savings.
+    The oracle is profiled first, unless you pass its `OracleProfile`.
+    """
+    if not isinstance(encryption_func, CachedOracle):
+        encryption_func = CachedOracle(encryption_func)
+    if profile is None:
+        profile = profile_oracle(encryption_func)
+    if not detect_cipher(encryption_func, profile):
+        raise ValueError('byte at a time decryption needs an ECB oracle')
 
     results = ''
-    for pos in range(unknowns_len):
-        next_letter = ecb_decrypt_char(block_size, pos, results)
+    for pos in range(profile.suffix_len):
+        next_letter = ecb_decrypt_char(
+            profile.block_size, pos, results, encryption_func, profile.prefix_len
+        )
         results += next_letter
-    return results.rstrip(PAD_CHAR.decode())
+    return results
 
 
 def test_ecb_decrypt():
@@ -185,3 +227,87 @@ def test_ecb_decrypt():
         """
     )
     assert ecb_decrypt() == expected_text
+
+    def unbatched_oracle(plaintext):
+        return encryption_oracle(plaintext)
+
+    assert ecb_decrypt(unbatched_oracle) == expected_text
+
+
+def test_ecb_decrypt_prefix():
+    prefix = b'a fixed, random-length prefix'
+
+    def prefixed_oracle(plaintext):
+        return encryption_oracle(prefix + plaintext)
+
+    profile = profile_oracle(prefixed_oracle)
+    assert profile.prefix_len == len(prefix)
+    assert profile.suffix_len == len(b64decode(UNKNOWN_STRING))
+    assert ecb_decrypt(prefixed_oracle, profile) == ecb_decrypt()
+
+
+def fixed_oracle(prefix, suffix):
+    def oracle(plaintext):
+        return encrypt_ecb(pad(prefix + plaintext + suffix, 16), CONSISTENT_KEY)
+
+    return oracle
+
+
+@pytest.mark.parametrize(
+    'prefix, suffix',
+    [
+        (b'x' * 15 + b'BB', b'secret'),
+        (b'B', b'secret'),
+        (b'xA', b'Bsecret'),
+        (b'x' * 20 + b'AAA', b'BBsecret'),
+        (b'x' * 30 + b'BA', b'AAsecret'),
+        (b'A' * 16, b'B' * 16),
+        # the suffix's own repeated blocks, shifted by our input
+        (b'xyz', b'hello ' + b'0' * 40),
+        (b'xyz', b'S' * 40),
+        (b'xyz', b'A' * 40),
+        (b'B' * 20, b'B' * 40),
+    ],
+)
+def test_ecb_decrypt_filler_prefix_suffix(prefix, suffix):
+    # prefix and suffix bytes that match the profiling filler
+    oracle = fixed_oracle(prefix, suffix)
+    profile = profile_oracle(oracle)
+    assert (profile.prefix_len, profile.suffix_len) == (len(prefix), len(suffix))
+    assert ecb_decrypt(oracle, profile) == suffix.decode()
+
+
+def test_profile_oracle_filler_prefix_suffix():
+    for prefix_len in range(40):
+        for prefix_end in (b'', b'A', b'B', b'AB', b'BA', b'AAB'):
+            # whole blocks of x repeat in the prefix itself
+            prefix = b'x' * prefix_len + prefix_end
+            for suffix in (b'', b'A', b'B', b'AB', b'BAx', b'B' * 40):
+                profile = profile_oracle(fixed_oracle(prefix, suffix))
+                assert profile == (16, True, len(prefix), len(suffix))
+
+
+def test_profile_oracle_cbc():
+    def cbc_oracle(plaintext):
+        return encrypt_cbc(pad(plaintext + b'secret', 16), CONSISTENT_KEY)
+
+    assert profile_oracle(cbc_oracle) == (16, False, None, None)
+    with pytest.raises(ValueError):
+        ecb_decrypt(cbc_oracle)
+
+
+def test_ecb_decrypt_cache():
+    cached_oracle = CachedOracle(encryption_oracle)
+    ecb_decrypt(cached_oracle)
+    # one of the 16 inputs made up of padding alone is queried for each of
+    # the 138 secret bytes, and 7 of them were already queried profiling
+    assert cached_oracle.hits == 138 - (16 - 7)
+
+
+def test_ecb_decrypt_cost():
+    text, report = run_metered(ecb_decrypt, encryption_oracle)
+    assert text == ecb_decrypt()
+    # a batch of candidates for each of the 138 secret bytes, the 9 inputs
+    # of padding alone not queried profiling, and 10 to profile the oracle
+    assert report['queries'] == 138 * len(ALPHABET) + 9 + 10
+    assert report['queries_per_byte'] == report['queries'] / len(text)
@@ -17,10 +17,13 @@ of padding to the end of the block. For instance,
 "YELLOW SUBMARINE\x04\x04\x04\x04"
 """
 
-from ..utils import pad
+from ..utils import pad, pkcs7_pad, unpad
 
 
 def test_padding_example():
     plaintext = b"YELLOW SUBMARINE"
     expected_padded = b"YELLOW SUBMARINE\x04\x04\x04\x04"
     assert pad(plaintext, 20) == expected_padded
+    # 4 bytes of padding, so PKCS#7 pads with \x04 too
+    assert pkcs7_pad(plaintext, 20) == expected_padded
+    assert unpad(expected_padded, 20) == plaintext
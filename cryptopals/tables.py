@@ -0,0 +1,138 @@
+import csv
+import mmap
+import os
+import struct
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+TABLE_NAMES = ('ngrams1', 'ngrams2', 'ngrams3')
+COMPILED_PATH = os.path.join(DATA_DIR, 'ngram_tables.bin')
+
+# file header: magic, format version, number of tables
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'CPNG'
+VERSION = 1
+# then per table: name, n, alphabet length, alphabet, data offset
+MAX_ALPHABET = 62
+ENTRY = struct.Struct('<16sBB{}sQ'.format(MAX_ALPHABET))
+# data is little-endian int64 counts, shaped (len(alphabet),) * n
+DTYPE = np.dtype('<i8')
+
+Table = namedtuple('Table', 'name alphabet counts')
+
+
+def csv_path(name, data_dir=DATA_DIR):
+    return os.path.join(data_dir, '{}_any_position.csv'.format(name))
+
+
+def read_csv_table(name, data_dir=DATA_DIR):
+    """Parse the CSV of n-gram counts `name` into a Table
+
+    Its alphabet is the sorted characters appearing in the n-grams, and
+    counts[i, j, ...] is the count of the n-gram alphabet[i] + alphabet[j]...
+    """
+    with open(csv_path(name, data_dir)) as f:
+        rdr = csv.reader(f)
+        next(rdr)  # col heading row
+        ngram_counts = {ngram: int(count) for ngram, count in rdr}
+    n = len(next(iter(ngram_counts)))
+    alphabet = ''.join(sorted(set(''.join(ngram_counts))))
+    counts = np.zeros((len(alphabet),) * n, dtype=DTYPE)
+    for ngram, count in ngram_counts.items():
+        counts[tuple(alphabet.index(ch) for ch in ngram)] = count
+    return Table(name, alphabet, counts)
+
+
+def compile_tables(path=COMPILED_PATH, names=TABLE_NAMES, data_dir=DATA_DIR):
+    """Write the CSV tables `names` to one binary file at `path`
+
+    A header and table index, then each table's counts as a fixed-layout
+    array, 8 byte aligned so it can be used straight from a memory map.
+    """
+    tables = [read_csv_table(name, data_dir) for name in names]
+    offset = HEADER.size + ENTRY.size * len(tables)
+    entries = []
+    for table in tables:
+        if len(table.alphabet) > MAX_ALPHABET:
+            raise ValueError('{} has too many characters'.format(table.name))
+        offset += -offset % DTYPE.itemsize
+        entries.append(
+            ENTRY.pack(
+                table.name.encode(),
+                table.counts.ndim,
+                len(table.alphabet),
+                table.alphabet.encode(),
+                offset,
+            )
+        )
+        offset += table.counts.nbytes
+
+    # write then rename, so readers never map a half written file
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(tables)))
+        f.write(b''.join(entries))
+        for table in tables:
+            f.write(b'\x00' * (-f.tell() % DTYPE.itemsize))
+            f.write(table.counts.tobytes())
+    os.replace(tmp_path, path)
+
+
+def is_stale(path=COMPILED_PATH, names=TABLE_NAMES, data_dir=DATA_DIR):
+    """Is the compiled file missing, or older than any of its CSVs?"""
+    try:
+        compiled_mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return True
+    return any(
+        os.stat(csv_path(name, data_dir)).st_mtime_ns > compiled_mtime for name in names
+    )
+
+
+def map_tables(path=COMPILED_PATH):
+    """return {name: Table} with counts as read-only views of the mapped file
+
+    The pages are shared by every process mapping the file, including
+    forked workers, rather than copied into each one.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, n_tables = HEADER.unpack_from(mapped)
+    if (magic, version) != (MAGIC, VERSION):
+        raise ValueError('{} is not a version {} table file'.format(path, VERSION))
+    tables = {}
+    for i in range(n_tables):
+        name, n, alphabet_len, alphabet, offset = ENTRY.unpack_from(
+            mapped, HEADER.size + i * ENTRY.size
+        )
+        name = name.rstrip(b'\x00').decode()
+        shape = (alphabet_len,) * n
+        counts = np.frombuffer(
+            mapped, dtype=DTYPE, count=alphabet_len ** n, offset=offset
+        ).reshape(shape)
+        tables[name] = Table(name, alphabet[:alphabet_len].decode(), counts)
+    return tables
+
+
+@lru_cache()
+def load_table(name, path=COMPILED_PATH, data_dir=DATA_DIR):
+    """The Table `name`, from the compiled file when it's fresh
+
+    Falls back on parsing the CSV when the compiled file is missing, stale
+    or unreadable. Build it with `python -m cryptopals.tables`.
+    """
+    if not is_stale(path, (name,), data_dir):
+        try:
+            return map_tables(path)[name]
+        except (OSError, ValueError, KeyError, struct.error):
+            pass
+    return read_csv_table(name, data_dir)
+
+
+if __name__ == '__main__':
+    compile_tables(*sys.argv[1:2])
@@ -1,15 +1,33 @@
 # -*- coding: utf-8 -*-
+import io
+import sys
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from Crypto.Cipher import AES
 
 from .aes import (
+    CBC_ENGINES,
+    IV,
+    CBCDecryptor,
+    CBCEncryptor,
+    CipherCache,
+    CTRCipher,
     _decrypt_cbc,
+    _decrypt_cbc_blocks,
     _encrypt_cbc,
+    ctr_counter_blocks,
     decrypt_cbc,
+    decrypt_cbc_file,
+    decrypt_ctr,
     decrypt_ecb,
     encrypt_cbc,
+    encrypt_cbc_file,
+    encrypt_ctr,
     encrypt_ecb,
 )
-from .utils import pad
+from .utils import pad, pkcs7_pad
 
 
 def test_aes_ecb():
@@ -54,13 +72,280 @@ def test_aes_cbc__my_cbc_de(n):
     assert decrypted == plaintext
 
 
+@pytest.mark.parametrize('engine', CBC_ENGINES)
 @pytest.mark.parametrize('n', range(20))
-def test_aes_cbc(n):
+def test_aes_cbc(n, engine):
     orig_plaintext = 'this is my message, cost=£££'.encode()
     plaintext = orig_plaintext[: len(orig_plaintext) - n]
     password = b'1234567890123456'
     plaintext_padded = pad(plaintext, 16)
     assert len(plaintext_padded) % 16 == 0
-    ciphertext = encrypt_cbc(plaintext_padded, password)
-    decrypted = decrypt_cbc(ciphertext, password)
+    ciphertext = encrypt_cbc(plaintext_padded, password, engine=engine)
+    decrypted = decrypt_cbc(ciphertext, password, engine=engine)
+    assert decrypted == plaintext
+
+
+@pytest.mark.parametrize('n', [0, 1, 15, 16, 17, 40])
+def test_aes_cbc_engines_agree(n):
+    # unpadded, so the engines must also agree on padding partial blocks
+    plaintext = bytes(range(256))[:n] + b'\x04'
+    password = b'1234567890123456'
+    iv = b'abcdefghijklmnop'
+    ciphertext = encrypt_cbc(plaintext, password, iv, engine='native')
+    assert ciphertext == encrypt_cbc(plaintext, password, iv, engine='reference')
+    for engine in CBC_ENGINES:
+        # and on the ciphertext truncated to a partial block
+        truncated = ciphertext[:-1]
+        assert decrypt_cbc(truncated, password, iv, engine='native') == decrypt_cbc(
+            truncated, password, iv, engine=engine
+        )
+        assert decrypt_cbc(ciphertext, password, iv, engine=engine) == plaintext[:n]
+
+
+# include runs of PAD_CHAR, at the end and split across blocks
+STREAM_PLAINTEXT = (
+    'this is my streamed message, cost=£££ '.encode() * 5
+    + b'\x04' * 20
+    + b'more text'
+    + b'\x04' * 3
+)
+
+
+def chunked(data, chunk_size):
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 16, 17, 100, 1000])
+@pytest.mark.parametrize('n', [0, 3, 16, 17])
+def test_cbc_encryptor(chunk_size, n):
+    plaintext = STREAM_PLAINTEXT[: len(STREAM_PLAINTEXT) - n]
+    password = b'1234567890123456'
+    encryptor = CBCEncryptor(password, engine='reference')
+    ciphertext = b''.join(
+        encryptor.update(chunk) for chunk in chunked(plaintext, chunk_size)
+    )
+    ciphertext += encryptor.finalize()
+    assert ciphertext == encrypt_cbc(plaintext, password)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 16, 17, 100, 1000])
+@pytest.mark.parametrize('n', [0, 3, 16, 17])
+def test_cbc_decryptor(chunk_size, n):
+    password = b'1234567890123456'
+    # drop some bytes, to check partial blocks are handled as decrypt_cbc does
+    ciphertext = encrypt_cbc(STREAM_PLAINTEXT, password)[:-n or None]
+    decryptor = CBCDecryptor(password)
+    plaintext = b''.join(
+        decryptor.update(chunk) for chunk in chunked(ciphertext, chunk_size)
+    )
+    plaintext += decryptor.finalize()
+    assert plaintext == decrypt_cbc(ciphertext, password)
+
+
+def test_cbc_file_round_trip():
+    password = b'1234567890123456'
+    iv = b'abcdefghijklmnop'
+    plaintext = STREAM_PLAINTEXT + b'.'
+    encrypted = io.BytesIO()
+    encrypt_cbc_file(io.BytesIO(plaintext), encrypted, password, iv, chunk_size=7)
+    assert encrypted.getvalue() == encrypt_cbc(plaintext, password, iv)
+
+    encrypted.seek(0)
+    decrypted = io.BytesIO()
+    decrypt_cbc_file(encrypted, decrypted, password, iv, chunk_size=7)
+    assert decrypted.getvalue() == plaintext
+
+    plaintext += b'\x04'
+    encrypted = io.BytesIO()
+    encrypt_cbc_file(io.BytesIO(plaintext), encrypted, password, padding='pkcs7')
+    encrypted.seek(0)
+    decrypted = io.BytesIO()
+    decrypt_cbc_file(encrypted, decrypted, password, padding='pkcs7')
+    assert decrypted.getvalue() == plaintext
+
+
+@pytest.mark.parametrize('engine', CBC_ENGINES)
+@pytest.mark.parametrize('n', [0, 1, 15, 16, 17, 40])
+def test_aes_cbc_pkcs7(n, engine):
+    # ends in PAD_CHAR, which legacy padding would strip
+    plaintext = bytes(range(256))[:n] + b'\x04'
+    password = b'1234567890123456'
+    iv = b'abcdefghijklmnop'
+    ciphertext = encrypt_cbc(plaintext, password, iv, engine=engine, padding='pkcs7')
+    assert ciphertext == AES.new(password, AES.MODE_CBC, iv).encrypt(
+        pkcs7_pad(plaintext, 16)
+    )
+    decrypted = decrypt_cbc(ciphertext, password, iv, engine=engine, padding='pkcs7')
+    assert decrypted == plaintext
+    legacy = encrypt_cbc(plaintext, password, iv, engine=engine, padding='legacy')
+    assert decrypt_cbc(legacy, password, iv, engine=engine) == plaintext[:n]
+    assert decrypt_cbc(ciphertext, password, iv, padding=None) == pkcs7_pad(
+        plaintext, 16
+    )
+    # zero the final plaintext byte, by flipping bits of the block before
+    pad_len = 16 - len(plaintext) % 16
+    tampered = bytearray(iv + ciphertext)
+    tampered[-17] ^= pad_len
+    with pytest.raises(ValueError):
+        decrypt_cbc(tampered[16:], password, tampered[:16], padding='pkcs7')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 16, 17, 100, 1000])
+@pytest.mark.parametrize('n', [0, 3, 16, 17])
+def test_cbc_stream_pkcs7(chunk_size, n):
+    plaintext = STREAM_PLAINTEXT[: len(STREAM_PLAINTEXT) - n]
+    password = b'1234567890123456'
+    encryptor = CBCEncryptor(password, padding='pkcs7')
+    ciphertext = b''.join(
+        encryptor.update(chunk) for chunk in chunked(plaintext, chunk_size)
+    )
+    ciphertext += encryptor.finalize()
+    assert ciphertext == encrypt_cbc(plaintext, password, padding='pkcs7')
+
+    decryptor = CBCDecryptor(password, padding='pkcs7')
+    decrypted = b''.join(
+        decryptor.update(chunk) for chunk in chunked(ciphertext, chunk_size)
+    )
+    decrypted += decryptor.finalize()
     assert decrypted == plaintext
+
+
+def test_cipher_cache():
+    cache = CipherCache(maxsize=2)
+    key1, key2, key3 = b'1' * 16, b'2' * 16, b'3' * 16
+    cipher = cache.get(key1)
+    assert cache.get(key1) is cipher
+    assert cache.get(key1, AES.MODE_ECB) is cipher
+    assert cache.info() == (2, 1, 2, 1)
+    cache.get(key2)
+    # key1 was the least recently used
+    cache.get(key3)
+    assert cache.get(key1) is not cipher
+    assert cache.info() == (2, 4, 2, 2)
+
+
+def test_cipher_cache_bytes_like_key():
+    cache = CipherCache()
+    cipher = cache.get(b'1' * 16)
+    assert cache.get(bytearray(b'1' * 16)) is cipher
+    assert cache.get(memoryview(b'1' * 16)) is cipher
+    assert cache.info() == (2, 1, cache.maxsize, 1)
+    plaintext = b'sixteen byte msg'
+    ciphertext = encrypt_ecb(plaintext, bytearray(b'1' * 16))
+    assert decrypt_ecb(ciphertext, memoryview(b'1' * 16)) == plaintext
+
+
+def test_cipher_cache_clear():
+    cache = CipherCache()
+    cipher = cache.get(b'1' * 16)
+    cache.clear()
+    assert cache.info() == (0, 0, cache.maxsize, 0)
+    assert cache.get(b'1' * 16) is not cipher
+
+
+def test_cipher_cache_per_thread():
+    cache = CipherCache()
+    key = b'1' * 16
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ciphers = list(executor.map(lambda _: cache.get(key), range(2)))
+    main_cipher = cache.get(key)
+    assert main_cipher not in ciphers
+    assert cache.misses >= 2
+    assert cache.hits + cache.misses == 3
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+@pytest.mark.parametrize('n', [0, 1, 16, 17, 1000])
+def test_aes_cbc_parallel_decrypt(mocker, workers, n):
+    mocker.patch('cryptopals.aes.PARALLEL_MIN_SIZE', 0)
+    plaintext = bytes(range(256)) * 4 + b'\x04'
+    password = b'1234567890123456'
+    iv = b'abcdefghijklmnop'
+    # truncated, to include a partial final block
+    ciphertext = encrypt_cbc(plaintext, password, iv)[:-n or None]
+    expected = decrypt_cbc(ciphertext, password, iv)
+    assert (
+        decrypt_cbc(ciphertext, password, iv, engine='reference', workers=workers)
+        == expected
+    )
+
+
+def test_aes_cbc_parallel_decrypt_native_serial(mocker):
+    mocker.patch('cryptopals.aes.PARALLEL_MIN_SIZE', 0)
+    executor = mocker.patch('cryptopals.aes.ProcessPoolExecutor')
+    plaintext = bytes(range(256)) * 4
+    password = b'1234567890123456'
+    ciphertext = encrypt_cbc(plaintext, password)
+    assert decrypt_cbc(ciphertext, password, engine='native', workers=2) == plaintext
+    executor.assert_not_called()
+
+
+@pytest.mark.parametrize('engine', CBC_ENGINES)
+def test_aes_cbc_decrypt_into(engine):
+    plaintext = bytes(range(256)) * 4
+    password = b'1234567890123456'
+    ciphertext = encrypt_cbc(plaintext, password)
+    out = bytearray(len(ciphertext) + 16)
+    # writing into a view of a larger buffer, as the parallel workers do
+    with memoryview(out)[16:] as view:
+        _decrypt_cbc_blocks(ciphertext, password, IV, 16, engine, view)
+    assert out[16:] == plaintext
+
+
+def test_aes_cbc_parallel_decrypt_without_shared_memory(mocker):
+    mocker.patch('cryptopals.aes.PARALLEL_MIN_SIZE', 0)
+    # as on Python 3.7, where the import fails
+    mocker.patch.dict(sys.modules, {'multiprocessing.shared_memory': None})
+    executor = mocker.patch('cryptopals.aes.ProcessPoolExecutor')
+    plaintext = bytes(range(256)) * 4
+    password = b'1234567890123456'
+    ciphertext = encrypt_cbc(plaintext, password)
+    assert decrypt_cbc(ciphertext, password, engine='reference', workers=2) == plaintext
+    executor.assert_not_called()
+
+
+def test_ctr_example():
+    # from cryptopals challenge 18
+    ciphertext = b64decode(
+        b'L77na/nrFsKvynd6HzOoG7GHTLXsTVu9qvY/2syLXzhPweyyMTJULu/6/kXX0KSvoOLSFQ=='
+    )
+    plaintext = decrypt_ctr(ciphertext, b'YELLOW SUBMARINE')
+    assert plaintext == b"Yo, VIP Let's kick it Ice, Ice, baby Ice, Ice, baby "
+    assert encrypt_ctr(plaintext, b'YELLOW SUBMARINE') == ciphertext
+
+
+def test_ctr_big_endian_matches_library():
+    password = b'1234567890123456'
+    nonce = b'noncenon'
+    plaintext = bytes(range(256)) * 3
+    library = AES.new(password, AES.MODE_CTR, nonce=nonce, initial_value=5)
+    ciphertext = encrypt_ctr(
+        plaintext, password, nonce, byteorder='big', initial_value=5
+    )
+    assert ciphertext == library.encrypt(plaintext)
+
+
+def test_ctr_counter_blocks_wrap():
+    blocks = ctr_counter_blocks(b'\xff' * 14, 2 ** 16 - 1, 2, byteorder='big')
+    assert blocks == b'\xff' * 16 + b'\xff' * 14 + b'\x00\x00'
+
+
+@pytest.mark.parametrize('offset', [0, 1, 15, 16, 17, 700])
+@pytest.mark.parametrize('length', [0, 1, 16, 33])
+def test_ctr_seek(offset, length):
+    password = b'1234567890123456'
+    plaintext = bytes(range(256)) * 3
+    ciphertext = encrypt_ctr(plaintext, password)
+    cipher = CTRCipher(password)
+    cipher.seek(offset)
+    chunk = cipher.decrypt(ciphertext[offset : offset + length])
+    assert chunk == plaintext[offset : offset + length]
+    assert cipher.tell() == offset + min(length, len(plaintext) - offset)
+
+
+def test_ctr_parallel_keystream(mocker):
+    mocker.patch('cryptopals.aes.CTR_BATCH_BLOCKS', 3)
+    password = b'1234567890123456'
+    serial = CTRCipher(password).keystream(5, 300)
+    assert CTRCipher(password, workers=4).keystream(5, 300) == serial
+    assert len(serial) == 300
@@ -0,0 +1,32 @@
+from .ngram_corpus import corpus_text, prose_lines, write_ngram_csvs
+from .tables import read_csv_table
+
+
+def test_prose_lines():
+    text = '\n'.join(
+        [
+            'A line of prose, with punctuation.',
+            '',
+            '   >>> print(x)',
+            '         indented = example(code)',
+            'x = {1: [2, 3]}',
+        ]
+    )
+    assert list(prose_lines(text)) == ['A line of prose, with punctuation.']
+
+
+def test_corpus_text():
+    text = corpus_text()
+    assert len(text) > 10 ** 5
+    assert b'>>>' not in text
+
+
+def test_write_ngram_csvs(tmp_path):
+    write_ngram_csvs(data_dir=str(tmp_path), text=b'the cat, the hat')
+    table = read_csv_table('ngrams2', str(tmp_path))
+    # the comma counted as punctuation, '.'
+    assert table.alphabet == ' .ACEHT'
+    th = tuple(table.alphabet.index(ch) for ch in 'TH')
+    assert table.counts[th] == 2
+    table = read_csv_table('ngrams3', str(tmp_path))
+    assert table.counts.shape == (7, 7, 7)
@@ -1,5 +1,13 @@
 from .aes import encrypt_cbc, encrypt_ecb
-from .oracle import detect_cipher, encryption_oracle
+from .oracle import (
+    CachedOracle,
+    MeteredOracle,
+    detect_cipher,
+    encryption_oracle,
+    encryption_oracle_many,
+    oracle_many,
+    run_metered,
+)
 from .testing_utils import reproducible_randomness
 from .utils import random_bytes
 
@@ -11,6 +19,22 @@ def test_random_bytes():
     assert len(random_bytes(16)) == 16
 
 
+def test_oracle_many():
+    def reverse(plaintext):
+        return plaintext[::-1]
+
+    assert oracle_many(reverse, [b'ab', b'cd']) == [b'ba', b'dc']
+    reverse.many = lambda plaintexts: ['batched']
+    assert oracle_many(reverse, [b'ab', b'cd']) == ['batched']
+
+
+def test_encryption_oracle_many(reproducible_randomness):
+    ciphertexts = oracle_many(encryption_oracle, [b'', b'A' * 16])
+    assert encryption_oracle.many is encryption_oracle_many
+    assert len(ciphertexts) == 2
+    assert all(len(ciphertext) % 16 == 0 for ciphertext in ciphertexts)
+
+
 def test_oracle(mocker, reproducible_randomness):
     m_encrypt_ecb = mocker.patch(
         'cryptopals.oracle.encrypt_ecb', side_effect=encrypt_ecb
@@ -28,3 +52,39 @@ def test_oracle(mocker, reproducible_randomness):
         cbc_covered = cbc_covered or m_encrypt_cbc.called
         m_encrypt_ecb.reset_mock()
         m_encrypt_cbc.reset_mock()
+
+
+def test_cached_oracle(mocker):
+    oracle = mocker.Mock(side_effect=lambda plaintext: plaintext.upper(), spec=[])
+    cached_oracle = CachedOracle(oracle, maxsize=2)
+    assert cached_oracle(b'a') == b'A'
+    assert cached_oracle(b'a') == b'A'
+    assert oracle.call_count == 1
+    assert cached_oracle.many([b'b', b'a', b'c', b'c']) == [b'B', b'A', b'C', b'C']
+    assert oracle.call_count == 3
+    # b'a' was the least recently used
+    assert cached_oracle.info() == (3, 3, 2, 2)
+    cached_oracle(b'a')
+    assert oracle.call_count == 4
+
+
+def test_metered_oracle():
+    metered_oracle = MeteredOracle(lambda plaintext: plaintext * 2)
+    assert metered_oracle(b'ab') == b'abab'
+    assert metered_oracle.many([b'c', b'de']) == [b'cc', b'dede']
+    report = metered_oracle.report(recovered_bytes=2)
+    assert report['queries'] == 3
+    assert report['calls'] == 2
+    assert report['bytes_sent'] == 5
+    assert report['bytes_received'] == 10
+    assert report['queries_per_byte'] == 1.5
+    assert sum(report['latency_histogram_us'].values()) == 2
+    metered_oracle.reset()
+    assert metered_oracle.report()['queries'] == 0
+
+
+def test_run_metered_detect_cipher(reproducible_randomness):
+    is_ecb, report = run_metered(detect_cipher, encryption_oracle)
+    assert is_ecb in (True, False)
+    assert report['queries'] == 1
+    assert 'queries_per_byte' not in report
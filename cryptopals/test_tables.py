@@ -0,0 +1,90 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from .tables import (
+    DATA_DIR,
+    TABLE_NAMES,
+    compile_tables,
+    csv_path,
+    is_stale,
+    load_table,
+    map_tables,
+    read_csv_table,
+)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for name in TABLE_NAMES:
+        shutil.copy(csv_path(name), str(tmp_path))
+    return str(tmp_path)
+
+
+def test_read_csv_table():
+    table = read_csv_table('ngrams1')
+    assert table.alphabet == 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    assert table.counts[table.alphabet.index('E')] == 445155370175
+    table = read_csv_table('ngrams2')
+    assert table.counts.shape == (len(table.alphabet),) * 2
+    t, h = table.alphabet.index('T'), table.alphabet.index('H')
+    assert table.counts[t, h] > table.counts[h, t] > 0
+
+
+def test_compile_tables_round_trip(data_dir):
+    path = os.path.join(data_dir, 'tables.bin')
+    compile_tables(path, data_dir=data_dir)
+    tables = map_tables(path)
+    assert sorted(tables) == sorted(TABLE_NAMES)
+    for name, table in tables.items():
+        expected = read_csv_table(name, data_dir)
+        assert table.alphabet == expected.alphabet
+        assert np.array_equal(table.counts, expected.counts)
+        assert not table.counts.flags.writeable
+        assert table.counts.ctypes.data % 8 == 0
+
+
+def test_is_stale(data_dir):
+    path = os.path.join(data_dir, 'tables.bin')
+    assert is_stale(path, data_dir=data_dir)
+    compile_tables(path, data_dir=data_dir)
+    assert not is_stale(path, data_dir=data_dir)
+    csv_mtime = os.stat(path).st_mtime + 10
+    os.utime(csv_path('ngrams2', data_dir), (csv_mtime, csv_mtime))
+    assert is_stale(path, data_dir=data_dir)
+    assert not is_stale(path, ('ngrams1',), data_dir)
+
+
+def test_load_table_falls_back_on_csv(data_dir):
+    def is_mapped(name):
+        load_table.cache_clear()
+        table = load_table(name, path, data_dir)
+        assert np.array_equal(table.counts, read_csv_table(name, data_dir).counts)
+        # parsed tables are ordinary, writeable arrays
+        return not table.counts.flags.writeable
+
+    path = os.path.join(data_dir, 'tables.bin')
+    assert not is_mapped('ngrams1')  # missing
+
+    compile_tables(path, data_dir=data_dir)
+    assert is_mapped('ngrams1')
+
+    csv_mtime = os.stat(path).st_mtime + 10
+    os.utime(csv_path('ngrams1', data_dir), (csv_mtime, csv_mtime))
+    assert not is_mapped('ngrams1')  # stale
+    assert is_mapped('ngrams2')
+
+    with open(path, 'r+b') as f:
+        f.write(b'junk')
+    assert not is_mapped('ngrams2')  # unreadable
+    load_table.cache_clear()
+
+
+def test_load_table_default_paths(monkeypatch):
+    # independent of the working directory
+    monkeypatch.chdir('/')
+    load_table.cache_clear()
+    assert load_table('ngrams1').alphabet == 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    assert csv_path('ngrams1').startswith(DATA_DIR)
@@ -0,0 +1,145 @@
+import json
+import threading
+import tracemalloc
+
+import pytest
+
+from .set1.chal6 import decrypt_repeating_key_xor
+from .set2.chal12 import ecb_decrypt
+from .tracing import NULL_SPAN, count, span, traced, tracing
+from .utils import xor
+
+
+def test_span_disabled():
+    assert span('stage', arg=1) is NULL_SPAN
+    with span('stage'):
+        count('things')
+
+
+def test_tracing_spans_and_counters():
+    @traced('double')
+    def double(x):
+        return 2 * x
+
+    with tracing() as tracer:
+        with span('outer', size=3):
+            assert double(1) == 2
+            assert double(2) == 4
+            count('items', 3)
+            count('items')
+    # and off again
+    assert double(3) == 6
+    assert span('outer') is NULL_SPAN
+
+    assert [event.name for event in tracer.events] == ['double', 'double', 'outer']
+    outer = tracer.events[-1]
+    assert outer.args == {'size': 3}
+    assert outer.duration >= sum(event.duration for event in tracer.events[:2])
+    report = tracer.report()
+    assert report['counters'] == {'items': 4}
+    assert report['spans']['double']['calls'] == 2
+    assert 'peak_bytes' not in report['spans']['double']
+    json.dumps(report)
+
+
+def test_tracing_memory():
+    with tracing(trace_memory=True) as tracer:
+        with span('outer'):
+            kept = bytearray(10 ** 5)
+            with span('inner'):
+                bytearray(10 ** 6)
+    inner, outer = tracer.events
+    assert 10 ** 6 <= inner.peak_bytes < 2 * 10 ** 6
+    assert outer.peak_bytes >= inner.peak_bytes + len(kept)
+
+
+def test_tracing_memory_needs_reset_peak(mocker):
+    mocker.patch.object(tracemalloc, 'reset_peak', create=True)
+    del tracemalloc.reset_peak
+    with pytest.raises(RuntimeError, match='Python 3.9'):
+        with tracing(trace_memory=True):
+            pass
+    assert not tracemalloc.is_tracing()
+
+
+def test_tracing_threads():
+    # all open at once, so thread ids aren't reused
+    barrier = threading.Barrier(3)
+
+    def work():
+        with span('work'):
+            barrier.wait()
+
+    with tracing() as tracer:
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert len({event.thread_id for event in tracer.events}) == 3
+
+
+def test_tracing_threads_count():
+    def work():
+        for _ in range(10 ** 4):
+            count('things')
+
+    with tracing() as tracer:
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert tracer.counters['things'] == 4 * 10 ** 4
+
+
+def test_chrome_trace(tmp_path):
+    with tracing() as tracer:
+        with span('stage', keysize=29):
+            count('items', 2)
+    path = str(tmp_path / 'trace.json')
+    tracer.write_chrome_trace(path)
+    with open(path) as f:
+        stage, items = json.load(f)['traceEvents']
+    assert stage['name'] == 'stage' and stage['ph'] == 'X'
+    assert stage['args'] == {'keysize': 29}
+    assert stage['dur'] > 0
+    assert items == {
+        'name': 'items',
+        'ph': 'C',
+        'ts': stage['ts'] + stage['dur'],
+        'pid': stage['pid'],
+        'args': {'items': 2},
+    }
+    path = str(tmp_path / 'report.json')
+    tracer.write_json(path)
+    with open(path) as f:
+        assert json.load(f) == tracer.report()
+
+
+def test_tracing_attacks():
+    plaintext = b'Burning em, if you aint quick and nimble. ' * 4
+    with tracing() as tracer:
+        decrypt_repeating_key_xor(xor(plaintext, b'ICE'))
+        ecb_decrypt()
+    spans = tracer.stats()
+    for name in (
+        'chal6.decrypt_repeating_key_xor',
+        'chal6.candidate_keysizes',
+        'chal6.decrypt_with_keysize',
+        'chal6.refine_key',
+        'chal3.rank_single_byte_xor_keys',
+        'chal12.ecb_decrypt',
+        'chal12.ecb_decrypt_char',
+        'oracle.profile',
+        'oracle.query',
+    ):
+        assert name in spans
+    assert spans['chal12.ecb_decrypt_char']['calls'] == 138
+    keysizes = {
+        event.args['keysize']
+        for event in tracer.events
+        if event.name == 'chal6.decrypt_with_keysize'
+    }
+    assert 3 in keysizes
+    assert tracer.counters['oracle.cache_hits'] == 138 - (16 - 7)
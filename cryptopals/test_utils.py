@@ -1,4 +1,25 @@
-from .utils import xor_hex, decode_hex
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from .utils import (
+    CSPRNG,
+    PADDINGS,
+    Padder,
+    RandomBytesPool,
+    Unpadder,
+    bounded_map,
+    decode_hex,
+    iter_blocks,
+    pad,
+    pkcs7_pad,
+    random_bytes,
+    unpad,
+    xor,
+    xor_hex,
+)
 
 
 def test_xor_hex_from_binary():
@@ -38,3 +59,207 @@ def test_short_output_padding():
     result = xor_hex(hex(0b01110011), hex(0b01111100))
     # no type error
     decode_hex(result)
+
+
+def test_xor_hex_accepts_bytes():
+    assert xor_hex(b'1C01', b'6869') == '7468'
+
+
+@pytest.mark.parametrize(
+    'data, key, expected',
+    [
+        (b'', b'', b''),
+        (b'\x0f\xf0', b'\xff\xff', b'\xf0\x0f'),
+        (b'aaaa', b'\x01', b'````'),
+        (b'abcde', b'\x00\x20', b'aBcDe'),
+    ],
+)
+def test_xor(data, key, expected):
+    assert xor(data, key) == expected
+
+
+def test_xor_bytes_like():
+    data = bytearray(b'message')
+    assert xor(memoryview(data)[1:4], b'   ') == b'ESS'
+
+
+def test_xor_out():
+    data = b'message'
+    out = bytearray(len(data))
+    assert xor(data, b' ', out=out) is out
+    assert out == b'MESSAGE'
+    # xor in place
+    assert xor(out, b' ', out=out) == data
+
+
+def test_xor_key_too_long():
+    with pytest.raises(AssertionError):
+        xor(b'a', b'ab')
+
+
+def test_random_bytes_seeded():
+    assert random_bytes(64, rng=random.Random(1)) == random_bytes(
+        64, rng=random.Random(1)
+    )
+    assert random_bytes(64, rng=random.Random(1)) != random_bytes(
+        64, rng=random.Random(2)
+    )
+    assert random_bytes(0) == b''
+    assert len(random_bytes(16, rng=CSPRNG)) == 16
+
+
+@pytest.mark.parametrize('upto', [1, 2, 10, 128, 200, 256])
+def test_random_bytes_upto(upto):
+    counts = Counter(random_bytes(upto * 100, upto=upto, rng=random.Random(upto)))
+    assert set(counts) == set(range(upto))
+    # roughly uniform, none of the bias of taking remainders alone
+    assert max(counts.values()) < 200
+
+
+def test_random_bytes_pool():
+    pool = RandomBytesPool(random.Random(1), size=32)
+    draws = [pool(10) for _ in range(7)]
+    # the same stream as 32 byte draws, in order, across refills
+    rng = random.Random(1)
+    stream = b''.join(random_bytes(32, rng=rng) for _ in range(3))
+    assert b''.join(draws) == stream[:70]
+    assert len(pool(100)) == 100
+    assert max(pool(1000, upto=10)) == 9
+
+
+@pytest.mark.parametrize(
+    'tail, expected',
+    [
+        ('pad', [b'abcd', b'efgh', b'ij\x04\x04']),
+        ('keep', [b'abcd', b'efgh', b'ij']),
+        ('drop', [b'abcd', b'efgh']),
+    ],
+)
+def test_iter_blocks_tail(tail, expected):
+    assert [bytes(block) for block in iter_blocks(b'abcdefghij', 4, tail)] == expected
+
+
+def test_iter_blocks_strict():
+    assert [bytes(block) for block in iter_blocks(b'abcdefgh', 4, 'strict')] == [
+        b'abcd',
+        b'efgh',
+    ]
+    with pytest.raises(ValueError):
+        iter_blocks(b'abcdefghij', 4, 'strict')
+    with pytest.raises(ValueError):
+        iter_blocks(b'abcd', 4, 'truncate')
+
+
+def test_iter_blocks_stride():
+    data = bytes(range(10))
+    blocks = iter_blocks(data, 2, 'keep', start=1, step=2)
+    assert [bytes(block) for block in blocks] == [b'\x02\x03', b'\x06\x07']
+    blocks = iter_blocks(data[:9], 2, 'keep', start=2, step=2)
+    assert [bytes(block) for block in blocks] == [b'\x04\x05', b'\x08']
+    assert list(iter_blocks(data, 2, start=6)) == []
+
+
+def test_iter_blocks_zero_copy():
+    data = bytearray(b'abcdefgh')
+    first, second = iter_blocks(data, 4)
+    data[4:] = b'EFGH'
+    assert second == b'EFGH'
+    assert first.obj is data
+    # any buffer, as bytes
+    assert list(iter_blocks(memoryview(b'abcd').cast('H'), 2)) == [b'ab', b'cd']
+
+
+@pytest.mark.parametrize('n', range(10))
+def test_pkcs7_round_trip(n):
+    # ending in what could be mistaken for padding
+    plaintext = b'abcdefgh\x04\x01'[-n:] if n else b''
+    padded = pkcs7_pad(plaintext, 4)
+    assert len(padded) % 4 == 0
+    assert 0 < len(padded) - len(plaintext) <= 4
+    assert unpad(padded, 4) == plaintext
+    assert unpad(memoryview(padded), 4) == plaintext
+
+
+@pytest.mark.parametrize(
+    'padded',
+    [b'', b'abc', b'abc\x00', b'abc\x05', b'ab\x03\x03', b'abcd\x01\x03\x02\x03'],
+)
+def test_pkcs7_bad_padding(padded):
+    with pytest.raises(ValueError):
+        unpad(padded, 4)
+
+
+def test_legacy_padding():
+    assert unpad(pad(b'abc', 4), 4, 'legacy') == b'abc'
+    # legacy can't tell padding from the message
+    assert unpad(pad(b'abc\x04', 4), 4, 'legacy') == b'abc'
+    assert unpad(pkcs7_pad(b'abc\x04', 4), 4) == b'abc\x04'
+    with pytest.raises(ValueError):
+        unpad(b'abcd', 4, 'PKCS#7')
+
+
+@pytest.mark.parametrize('padding', PADDINGS)
+def test_unpad_zero_copy(padding):
+    padded = bytearray(pkcs7_pad(b'abc', 4) if padding == 'pkcs7' else pad(b'abc', 4))
+    # a bytearray is trimmed in place
+    assert unpad(padded, 4, padding) is padded
+    assert padded == b'abc'
+    padded = pad(b'abc', 4) if padding == 'legacy' else pkcs7_pad(b'abc', 4)
+    unpadded = unpad(memoryview(padded), 4, padding)
+    assert unpadded == b'abc'
+    assert unpadded.obj is padded
+
+
+def chunked(data, chunk_size):
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+@pytest.mark.parametrize('padding', PADDINGS)
+@pytest.mark.parametrize('chunk_size', [1, 3, 4, 5, 16])
+@pytest.mark.parametrize('n', [0, 1, 4, 7, 8, 13])
+def test_padder_unpadder(padding, chunk_size, n):
+    plaintext = b'a\x04\x04 message\x04'[:n]
+    padder = Padder(4, padding)
+    padded = b''.join(padder.update(chunk) for chunk in chunked(plaintext, chunk_size))
+    assert len(padded) % 4 == 0
+    padded += padder.finalize()
+    expected = pkcs7_pad(plaintext, 4) if padding == 'pkcs7' else pad(plaintext, 4)
+    assert padded == expected
+
+    unpadder = Unpadder(4, padding)
+    unpadded = b''.join(unpadder.update(chunk) for chunk in chunked(padded, chunk_size))
+    unpadded += unpadder.finalize()
+    assert unpadded == unpad(padded, 4, padding)
+
+
+def test_padder_unpadder_zero_copy():
+    data = bytearray(b'abcdefgh')
+    padder = Padder(4)
+    assert padder.update(data).obj is data
+    assert padder.update(b'ij') == b''
+    # completing the held back partial block copies
+    assert padder.update(b'klmno') == b'ijkl'
+    unpadder = Unpadder(4)
+    assert unpadder.update(data).obj is data
+    # the final block is held back, and nothing more
+    assert unpadder._held == b'efgh'
+
+
+def test_unpadder_holds_back_final_block():
+    unpadder = Unpadder(4)
+    assert unpadder.update(b'abcdefg') == b'abc'
+    assert unpadder.update(b'\x01') == b'd'
+    assert unpadder.finalize() == b'efg'
+    unpadder.update(b'abcdefg\x01\x01')
+    with pytest.raises(ValueError):
+        unpadder.finalize()
+
+
+def test_bounded_map():
+    squares = [n * n for n in range(20)]
+    assert list(bounded_map(abs, range(-3, 0), 2, ThreadPoolExecutor)) == [3, 2, 1]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for _ in range(2):
+            # the executor outlives each call
+            square = bounded_map(lambda n: n * n, range(20), 2, executor=executor)
+            assert list(square) == squares
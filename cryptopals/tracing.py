@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+
+SpanEvent = namedtuple('SpanEvent', 'name start duration thread_id peak_bytes args')
+
+# the active Tracer, None while tracing is off
+_tracer = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        # the most memory allocated while open, as seen so far
+        self.peak_bytes = 0
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        if self.tracer.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # about to reset the peak, so first note it for the open span
+            if stack:
+                stack[-1]._note_peak(peak)
+            self.start_memory = current
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def _note_peak(self, peak):
+        self.peak_bytes = max(self.peak_bytes, peak - self.start_memory)
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        stack = self.tracer._stack()
+        stack.pop()
+        peak_bytes = None
+        if self.tracer.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            self._note_peak(peak)
+            peak_bytes = self.peak_bytes
+            if stack:
+                stack[-1]._note_peak(self.start_memory + peak_bytes)
+        self.tracer._record(
+            SpanEvent(
+                self.name,
+                self.start,
+                end - self.start,
+                threading.get_ident(),
+                peak_bytes,
+                self.args,
+            )
+        )
+        return False
+
+
+class Tracer:
+    """Collects timed spans and counters, see `tracing`
+
+    Spans are recorded per thread. Work done in worker processes isn't
+    seen. With `trace_memory`, each span also records the peak traced
+    memory allocated while it was open, at some cost in speed. That needs
+    tracemalloc.reset_peak, new in Python 3.9.
+    """
+
+    def __init__(self, trace_memory=False):
+        if trace_memory and not hasattr(tracemalloc, 'reset_peak'):
+            raise RuntimeError('trace_memory needs Python 3.9 or later')
+        self.trace_memory = trace_memory
+        self.events = []
+        self.counters = Counter()
+        self.start = time.perf_counter_ns()
+        self._local = threading.local()
+        # spans end and counts are made in any thread
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self.events), Counter(self.counters)
+
+    def stats(self):
+        """return {span name: {calls, total_s, mean_s, max_s[, peak_bytes]}}"""
+        events, _ = self._snapshot()
+        stats = {}
+        for event in events:
+            stat = stats.setdefault(
+                event.name, {'calls': 0, 'total_s': 0.0, 'max_s': 0.0}
+            )
+            secs = event.duration / 1e9
+            stat['calls'] += 1
+            stat['total_s'] += secs
+            stat['max_s'] = max(stat['max_s'], secs)
+            if event.peak_bytes is not None:
+                stat['peak_bytes'] = max(stat.get('peak_bytes', 0), event.peak_bytes)
+        for stat in stats.values():
+            stat['mean_s'] = stat['total_s'] / stat['calls']
+        return stats
+
+    def report(self):
+        "Per span name timings, and the counters, ready for json.dump"
+        _, counters = self._snapshot()
+        return {'spans': self.stats(), 'counters': dict(counters)}
+
+    def chrome_trace(self):
+        """The spans and counters in Chrome's trace event format
+
+        Load the JSON into chrome://tracing or https://ui.perfetto.dev
+        """
+        pid = os.getpid()
+        events, counters = self._snapshot()
+        trace_events = []
+        for event in events:
+            args = dict(event.args)
+            if event.peak_bytes is not None:
+                args['peak_bytes'] = event.peak_bytes
+            trace_events.append(
+                {
+                    'name': event.name,
+                    'ph': 'X',
+                    'ts': (event.start - self.start) / 1e3,
+                    'dur': event.duration / 1e3,
+                    'pid': pid,
+                    'tid': event.thread_id,
+                    'args': args,
+                }
+            )
+        end = max((event['ts'] + event['dur'] for event in trace_events), default=0)
+        for name, value in sorted(counters.items()):
+            trace_events.append(
+                {'name': name, 'ph': 'C', 'ts': end, 'pid': pid, 'args': {name: value}}
+            )
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+@contextmanager
+def tracing(trace_memory=False):
+    """Trace spans and counters within the with block, yielding the Tracer
+
+    Afterwards, export with the Tracer's `write_json` for per stage totals,
+    or `write_chrome_trace` for a timeline.
+    """
+    global _tracer
+    previous = _tracer
+    tracer = Tracer(trace_memory)
+    started_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    _tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+
+def span(name, **args):
+    """Context manager timing the stage `name`, with any `args` to record
+
+    While tracing is off this is a shared do-nothing context manager.
+    """
+    if _tracer is None:
+        return NULL_SPAN
+    return _tracer.span(name, **args)
+
+
+def count(name, n=1):
+    "Add `n` to the counter `name`, while tracing"
+    if _tracer is not None:
+        _tracer.count(name, n)
+
+
+def traced(name):
+    "Decorator recording each call of the function as a span `name`"
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
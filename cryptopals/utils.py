@@ -1,9 +1,20 @@
 import random
-from base64 import b16decode, b16encode
+from base64 import b16decode
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from itertools import chain, repeat
 
+import numpy as np
+
 
 PAD_CHAR = b'\x04'
+# above this many bytes numpy's fixed overheads pay for themselves
+SMALL_XOR_SIZE = 512
+# for keys that need to be secret, rather than reproducible
+CSPRNG = random.SystemRandom()
+# how many random bytes a RandomBytesPool fetches at a time
+RANDOM_POOL_SIZE = 2 ** 12
 
 
 def decode_hex(input_hex):
@@ -11,27 +22,60 @@ def decode_hex(input_hex):
     return b16decode(input_hex.upper(), casefold=True)
 
 
+def _hex_to_bytes(input_hex):
+    "Hex to bytes, also accepting the 0x prefixed and odd length forms int() does"
+    if isinstance(input_hex, bytes):
+        input_hex = input_hex.decode()
+    if input_hex[:2].lower() == '0x':
+        input_hex = input_hex[2:]
+    return decode_hex(input_hex.zfill(len(input_hex) + len(input_hex) % 2))
+
+
 def xor_hex(h1, h2):
     n1 = len(h1)
     n2 = len(h2)
     assert n1 == n2
     # no support for differing length inputs at the moment
-    i1 = int(h1, base=16)
-    i2 = int(h2, base=16)
-    # ^ is XOR operator
-    result_int = i1 ^ i2
-    # use format to avoid 0x prefix
-    # pad with leading zeros, to match length of input
-    return '{:0{}x}'.format(result_int, n1)
-
-
-def xor(bs1, bs2):
-    n1 = len(bs1)
-    n2 = len(bs2)
-    # no support for differing length inputs at the moment
-    assert n1 == n2
-    hex_res = xor_hex(b16encode(bs1), b16encode(bs2))
-    return decode_hex(hex_res)
+    result_hex = xor(_hex_to_bytes(h1), _hex_to_bytes(h2)).hex()
+    # match the length of the input: trim the zero nibble added to odd length
+    # input, or pad back out over a 0x prefix
+    return result_hex[-n1:].zfill(n1)
+
+
+def xor(data, key, out=None):
+    """XOR bytes-like `data` with `key`, returning bytes
+
+    A `key` shorter than `data` is repeated to cover it, so a single byte
+    key XORs every byte of `data`. Pass a writable buffer of the same length
+    as `data` as `out` to have the result written there (and returned)
+    instead of allocating new bytes.
+
+    >>> xor(b'abc', b'   ')
+    b'ABC'
+    >>> xor(b'ABCD', b' ')
+    b'abcd'
+    >>> out = bytearray(3)
+    >>> xor(b'abc', b' ', out=out)
+    bytearray(b'ABC')
+    """
+    n = len(data)
+    m = len(key)
+    assert m <= n
+    assert m or not n
+    if out is None and m == n and n <= SMALL_XOR_SIZE:
+        # e.g. a cipher block: let CPython's big ints do it a word at a time
+        result = int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')
+        return result.to_bytes(n, 'big')
+    data_array = np.frombuffer(data, dtype=np.uint8)
+    key_array = np.frombuffer(key, dtype=np.uint8)
+    if m > 1 and m != n:
+        # repeat the key out to the length of the data
+        key_array = np.resize(key_array, n)
+    if out is None:
+        return np.bitwise_xor(data_array, key_array).tobytes()
+    assert len(out) == n
+    np.bitwise_xor(data_array, key_array, out=np.frombuffer(out, dtype=np.uint8))
+    return out
 
 
 def pad(plaintext, block_size, pad_char=PAD_CHAR):
@@ -39,11 +83,289 @@ def pad(plaintext, block_size, pad_char=PAD_CHAR):
     return plaintext + n * pad_char
 
 
+# the padding schemes: PKCS#7, or `pad`'s runs of PAD_CHAR
+PADDINGS = ('pkcs7', 'legacy')
+
+
+def _check_padding(padding):
+    if padding not in PADDINGS:
+        raise ValueError('padding must be one of {}'.format(PADDINGS))
+
+
+def pkcs7_pad(plaintext, block_size):
+    "Append n bytes of value n, from 1 up to a whole block of them"
+    n = block_size - (len(plaintext) % block_size)
+    return plaintext + bytes([n]) * n
+
+
+def pad_tail(data, block_size, padding='pkcs7'):
+    """return (n, tail), where data[:n] + tail is `data` padded
+
+    data[:n] is all the whole blocks, needing no change, so only the final
+    partial block is copied, into `tail`.
+    """
+    _check_padding(padding)
+    n = len(data) - len(data) % block_size
+    if padding == 'legacy':
+        return n, pad(bytes(data[n:]), block_size)
+    return n, pkcs7_pad(bytes(data[n:]), block_size)
+
+
+def pkcs7_padding_len(data, block_size):
+    """The length of the PKCS#7 padding ending `data`, ValueError if invalid
+
+    Only the final block is looked at.
+    """
+    if not len(data) or len(data) % block_size:
+        raise ValueError('PKCS#7 padded data is a whole number of blocks')
+    n = data[-1]
+    if not 0 < n <= block_size or data[-n:] != bytes([n]) * n:
+        raise ValueError('bad PKCS#7 padding')
+    return n
+
+
+def legacy_padding_len(data):
+    "The length of the run of PAD_CHAR ending `data`, any bytes-like"
+    end = len(data)
+    while end and data[end - 1] == PAD_CHAR[0]:
+        end -= 1
+    return len(data) - end
+
+
+def unpad(data, block_size, padding='pkcs7'):
+    """Strip `padding` from `data`, checking that PKCS#7 padding is valid
+
+    Nothing is copied: a bytearray is trimmed in place and returned, any
+    other bytes-like gives a memoryview of all but the padding. 'legacy'
+    strips any trailing run of PAD_CHAR, including any that was part of
+    the message itself.
+    """
+    _check_padding(padding)
+    if padding == 'legacy':
+        n = legacy_padding_len(data)
+    else:
+        n = pkcs7_padding_len(data, block_size)
+    if isinstance(data, bytearray):
+        del data[len(data) - n :]
+        return data
+    return memoryview(data)[: len(data) - n]
+
+
+class Padder:
+    """Incremental `padding`, as a stage in a stream
+
+    `update` returns whole blocks as soon as they're complete, holding back
+    any partial block. `finalize` returns it padded. Only a partial block
+    held back from the previous update is copied: otherwise what's
+    returned is a memoryview of `data`.
+    """
+
+    def __init__(self, block_size, padding='pkcs7'):
+        _check_padding(padding)
+        self.block_size = block_size
+        self.padding = padding
+        self._partial = b''
+
+    def update(self, data):
+        total = len(self._partial) + len(data)
+        end = total - total % self.block_size - len(self._partial)
+        if end < 0:
+            self._partial += bytes(data)
+            return b''
+        body = memoryview(data)[:end]
+        out = self._partial + body if self._partial else body
+        self._partial = bytes(data[end:])
+        return out
+
+    def finalize(self):
+        _, tail = pad_tail(self._partial, self.block_size, self.padding)
+        self._partial = b''
+        return tail
+
+
+class Unpadder:
+    """Incremental `unpad`, as a stage in a stream
+
+    For PKCS#7 `update` holds back the final block seen so far, for
+    `finalize` to check and strip, once the stream has ended. For 'legacy'
+    it holds back any trailing run of PAD_CHAR, which is only padding if
+    nothing else follows. Like Padder's, `update` returns a memoryview of
+    `data` when nothing was held back, and otherwise copies it just once.
+    """
+
+    def __init__(self, block_size, padding='pkcs7'):
+        _check_padding(padding)
+        self.block_size = block_size
+        self.padding = padding
+        self._held = b''
+        self._length = 0
+
+    def update(self, data):
+        self._length += len(data)
+        if self.padding == 'legacy':
+            run = legacy_padding_len(data)
+            if run == len(data):
+                # all padding so far, or none of it is
+                self._held += bytes(data)
+                return b''
+            end = len(data) - run
+        else:
+            end = len(data) - self.block_size
+            if end < 0:
+                # short of a block, so some of what's held goes
+                held = self._held + bytes(data)
+                cut = max(len(held) - self.block_size, 0)
+                self._held = held[cut:]
+                return held[:cut]
+        body = memoryview(data)[:end]
+        out = self._held + body if self._held else body
+        self._held = bytes(data[end:])
+        return out
+
+    def finalize(self):
+        held, length = self._held, self._length
+        self._held, self._length = b'', 0
+        if self.padding == 'legacy':
+            return b''
+        if length % self.block_size:
+            raise ValueError('PKCS#7 padded data is a whole number of blocks')
+        return held[: len(held) - pkcs7_padding_len(held, self.block_size)]
+
+
 def grouper(n, iterable, padvalue=PAD_CHAR):
     "grouper(3, 'abcdefg', 'x') --> ('a','b','c'), ('d','e','f'), ('g','x','x')"
     groups = zip(*[chain(iterable, repeat(ord(padvalue), n - 1))] * n)
     return map(bytes, groups)
 
 
-def random_bytes(n, upto=2 ** 8):
-    return bytes([(random.choice(range(upto))) for _ in range(n)])[:n]
+# what iter_blocks does with a final partial block
+TAIL_POLICIES = ('pad', 'keep', 'drop', 'strict')
+
+
+def iter_blocks(data, block_size, tail='pad', pad_char=PAD_CHAR, start=0, step=1):
+    """Yield each `block_size` block of bytes-like `data` as a memoryview
+
+    The blocks are slices of `data`, not copies. `tail` is what happens to
+    a final partial block: 'pad' it out with `pad_char`, as grouper does,
+    copying that block alone; 'keep' it short; 'drop' it; or 'strict' to
+    raise ValueError. `start` and `step` give every `step`th block from
+    block number `start`.
+
+    >>> [bytes(block) for block in iter_blocks(b'abcdefg', 3, pad_char=b'x')]
+    [b'abc', b'def', b'gxx']
+    >>> [bytes(block) for block in iter_blocks(b'abcdefg', 2, 'drop', step=2)]
+    [b'ab', b'ef']
+    """
+    if tail not in TAIL_POLICIES:
+        raise ValueError('tail must be one of {}'.format(TAIL_POLICIES))
+    view = memoryview(data).cast('B')
+    n_full, tail_len = divmod(len(view), block_size)
+    if tail_len and tail == 'strict':
+        raise ValueError(
+            '{} bytes is not a whole number of {} byte blocks'.format(
+                len(view), block_size
+            )
+        )
+    offsets = range(start * block_size, n_full * block_size, step * block_size)
+    ends = range(offsets.start + block_size, len(view) + 1, offsets.step)
+    slices = map(slice, offsets, ends)
+    blocks = map(view.__getitem__, slices)
+    is_tail_picked = n_full >= start and (n_full - start) % step == 0
+    if not (tail_len and tail in ('pad', 'keep') and is_tail_picked):
+        return blocks
+    last = view[n_full * block_size :]
+    if tail == 'pad':
+        last = memoryview(bytes(last) + pad_char * (block_size - tail_len))
+    return chain(blocks, [last])
+
+
+def _raw_random_bytes(rng, n):
+    if not n:
+        return b''
+    return rng.getrandbits(8 * n).to_bytes(n, 'little')
+
+
+@lru_cache()
+def _limit_tables(upto):
+    """return (translate table, bytes to delete) making uniform bytes below
+    `upto` out of uniform bytes
+
+    Bytes from the largest multiple of `upto` up are rejected, so every
+    remainder is equally likely.
+    """
+    limit = 256 - 256 % upto
+    table = bytes(byte % upto for byte in range(256))
+    return table, bytes(range(limit, 256))
+
+
+def _random_bytes_upto(draw, n, upto):
+    if upto == 2 ** 8:
+        return draw(n)
+    table, rejected = _limit_tables(upto)
+    acceptance = (256 - len(rejected)) / 256
+    result = b''
+    while len(result) < n:
+        wanted = n - len(result)
+        # enough, most of the time, to need no second draw
+        result += draw(int(wanted / acceptance) + 8).translate(table, rejected)
+    return result[:n]
+
+
+def random_bytes(n, upto=2 ** 8, rng=random):
+    """`n` random bytes, each below `upto`
+
+    Generated in bulk, from `rng`: anything with a `getrandbits` method.
+    The default, the random module, can be seeded to be reproducible, as
+    can random.Random(seed). Use CSPRNG for real keys.
+    """
+    return _random_bytes_upto(partial(_raw_random_bytes, rng), n, upto)
+
+
+class RandomBytesPool:
+    """Callable like `random_bytes`, serving many small draws from a buffer
+
+    Fetches `size` bytes from `rng` at a time, rather than calling it for
+    every draw.
+    """
+
+    def __init__(self, rng=random, size=RANDOM_POOL_SIZE):
+        self.rng = rng
+        self.size = size
+        self._buffer = b''
+        self._pos = 0
+
+    def _draw(self, n):
+        if self._pos + n > len(self._buffer):
+            self._buffer = self._buffer[self._pos :] + _raw_random_bytes(
+                self.rng, max(self.size, n)
+            )
+            self._pos = 0
+        data = self._buffer[self._pos : self._pos + n]
+        self._pos += n
+        return data
+
+    def __call__(self, n, upto=2 ** 8):
+        return _random_bytes_upto(self._draw, n, upto)
+
+
+def bounded_map(
+    func, iterable, workers, executor_class=ProcessPoolExecutor, executor=None
+):
+    """Like Executor.map, but only reading `iterable` a few items ahead
+
+    Executor.map submits every item up front, so a large lazy iterable would
+    end up in memory. Here there are at most two tasks per worker in flight.
+    Pass a running `executor` to share it between calls, rather than start
+    one of `executor_class`.
+    """
+    if executor is None:
+        with executor_class(max_workers=workers) as executor:
+            yield from bounded_map(func, iterable, workers, executor=executor)
+        return
+    futures = deque()
+    for item in iterable:
+        futures.append(executor.submit(func, item))
+        if len(futures) >= 2 * workers:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
@@ -4,7 +4,7 @@ from setuptools import find_packages, setup
 setup(
     name='cryptopals',
     packages=find_packages(),
-    install_requires=['pycrypto'],
+    install_requires=['pycrypto', 'numpy'],
     tests_require=[
         'tox',
         'pytest',